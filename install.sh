@@ -6,7 +6,7 @@ echo "Installing Raspberry Pi LCD Terminal..."
 sudo apt update && sudo apt upgrade -y && sudo apt autoremove -y
 
 # Install dependencies
-sudo apt install python3-rpi.gpio python3-pil python3-numpy python3-spidev p7zip-full git -y
+sudo apt install python3-rpi.gpio python3-pil python3-numpy python3-spidev python3-jeepney p7zip-full git -y
 
 # Download and extract Waveshare drivers
 cd ~
@@ -1,16 +1,40 @@
 import LCD_1in44
 import time
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageColor
 import RPi.GPIO as GPIO
 import subprocess
 import os
 import pwd
 import threading
-import select
+import selectors
+import socket
 import pty
 import termios
 import struct
 import fcntl
+import signal
+import io
+import codecs
+import re
+import collections
+import heapq
+import concurrent.futures
+import itertools
+import traceback
+import bisect
+import mmap
+import shutil
+import stat
+import errno
+from array import array
+import numpy as np
+
+try:
+    from jeepney import DBusAddress, HeaderFields, MatchRule, Properties, message_bus, new_method_call
+    from jeepney.io.blocking import open_dbus_connection
+    from jeepney.wrappers import unwrap_msg
+except ImportError:
+    open_dbus_connection = None  # WiFi falls back to nmcli
 
 # GPIO Pin definitions
 KEY_UP_PIN = 6
@@ -23,38 +47,2221 @@ KEY2_PIN = 20
 KEY3_PIN = 16
 BACKLIGHT_PIN = 24
 
+# Hold-to-repeat for the joystick directions
+REPEAT_DELAY = 0.4          # held this long before the first repeat
+REPEAT_INTERVAL = 0.15      # first gap between repeats...
+REPEAT_ACCELERATION = 0.85  # ...multiplied by this after every repeat...
+REPEAT_FASTEST = 0.03       # ...down to this
+REPEAT_STEP_EVERY = 10      # repeats before the step a repeat carries doubles
+REPEAT_MAX_STEP = 16
+
+# Terminal scrollback
+TERM_COLS = 21
+TERM_ROWS = 6
+MAX_SESSIONS = 4
+METRIC_SAMPLES = 64    # one sparkline pixel per sample
+SCROLLBACK_LINES = 2000
+SCROLLBACK_BYTES = 64 * 1024
+PAGER_ROWS = 8
+NANO_MAP_BYTES = 1024 * 1024   # nano maps files this big instead of reading them
+INDEX_CHUNK = 1024 * 1024
+HISTORY_FILE = '.pocket_terminal_history'
+HISTORY_LIMIT = 1000
+SUGGESTIONS = 3         # cells in the strip above the keyboard
+LISTING_CACHE = 32      # directories whose listings are kept for completion
+
+# Display geometry
+LCD_WIDTH = 128
+LCD_HEIGHT = 128
+
+# Persistent shell: sourced by each tab's bash; no visible prompt, just a
+# marker with the exit status and cwd after every command
+SHELL_RC = r'''
+[ -f ~/.bashrc ] && . ~/.bashrc
+PS1='' PS2=''
+PROMPT_COMMAND='printf "\033]777;pocket;%s;%s\007" "$?" "$PWD"'
+'''
+
+class DirtyRectDisplay:
+    """Push only the regions of a frame that changed since the last one sent"""
+    
+    def __init__(self, lcd, merge_gap=8, full_ratio=0.6):
+        self.lcd = lcd
+        self.merge_gap = merge_gap      # changed pixels closer than this share a rectangle
+        self.full_ratio = full_ratio    # above this fraction of the screen, send one full window
+        self.last_frame = None
+        
+        # The Waveshare driver streams pixels through its config module;
+        # without it we can only send whole frames with LCD_ShowImage
+        lcd_config = getattr(LCD_1in44, 'LCD_Config', None) or getattr(LCD_1in44, 'config', None)
+        self.spi_write = None
+        self.dc_pin = None
+        if lcd_config is not None and hasattr(lcd, 'LCD_SetWindows'):
+            self.spi_write = getattr(lcd_config, 'SPI_Write_Byte', None) or getattr(lcd_config, 'spi_writebyte', None)
+            self.dc_pin = getattr(lcd_config, 'LCD_DC_PIN', None)
+        if self.dc_pin is None:
+            self.spi_write = None
+    
+    def invalidate(self):
+        """Forget the last frame so the next one is sent in full"""
+        self.last_frame = None
+    
+    def to_rgb565(self, image):
+        rgb = np.asarray(image, dtype=np.uint16)
+        return ((rgb[..., 0] & 0xF8) << 8) | ((rgb[..., 1] & 0xFC) << 3) | (rgb[..., 2] >> 3)
+    
+    def dirty_rects(self, frame):
+        """Bounding boxes (x0, y0, x1, y1) of the pixels that differ from the last frame"""
+        changed = frame != self.last_frame
+        rows = np.flatnonzero(changed.any(axis=1))
+        if rows.size == 0:
+            return []
+        
+        rects = []
+        # Group changed rows into bands, then each band into column runs
+        row_splits = np.flatnonzero(np.diff(rows) > self.merge_gap) + 1
+        for band in np.split(rows, row_splits):
+            y0, y1 = int(band[0]), int(band[-1]) + 1
+            cols = np.flatnonzero(changed[y0:y1].any(axis=0))
+            col_splits = np.flatnonzero(np.diff(cols) > self.merge_gap) + 1
+            for run in np.split(cols, col_splits):
+                rects.append((int(run[0]), y0, int(run[-1]) + 1, y1))
+        return rects
+    
+    def push_rect(self, frame, rect):
+        x0, y0, x1, y1 = rect
+        data = frame[y0:y1, x0:x1].astype('>u2').tobytes()
+        self.lcd.LCD_SetWindows(x0, y0, x1, y1)
+        GPIO.output(self.dc_pin, GPIO.HIGH)
+        for i in range(0, len(data), 4096):
+            self.spi_write(list(data[i:i+4096]))
+    
+    def show(self, image):
+        frame = self.to_rgb565(image)
+        
+        if self.spi_write is None:
+            # No partial updates possible, but identical frames can still be skipped
+            if self.last_frame is None or not np.array_equal(frame, self.last_frame):
+                self.lcd.LCD_ShowImage(image, 0, 0)
+        elif self.last_frame is None:
+            self.push_rect(frame, (0, 0, LCD_WIDTH, LCD_HEIGHT))
+        else:
+            rects = self.dirty_rects(frame)
+            area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rects)
+            if area > self.full_ratio * LCD_WIDTH * LCD_HEIGHT:
+                rects = [(0, 0, LCD_WIDTH, LCD_HEIGHT)]
+            for rect in rects:
+                self.push_rect(frame, rect)
+        
+        self.last_frame = frame
+
+class GlyphAtlas:
+    """Pre-rendered character cells for a fixed-width font
+    
+    Printable ASCII is rasterized once; a line of text is then assembled by
+    indexing the cell array and pasted into the frame in a single call.
+    """
+    
+    FIRST_CHAR = 32
+    LAST_CHAR = 126
+    
+    def __init__(self, font, max_strips=256):
+        self.font = font
+        self.palettes = {}
+        self.strips = {}
+        self.max_strips = max_strips
+        
+        chars = ''.join(chr(c) for c in range(self.FIRST_CHAR, self.LAST_CHAR + 1))
+        try:
+            advances = {font.getlength(ch) for ch in chars}
+            self.cell_height = font.getbbox(chars)[3]
+        except Exception:
+            advances = set()
+        
+        # Proportional fonts keep using ImageDraw.text
+        self.monospace = len(advances) == 1 and float(next(iter(advances))).is_integer()
+        if not self.monospace:
+            return
+        
+        w = self.cell_width = int(next(iter(advances)))
+        cells = []
+        for ch in chars:
+            # Some glyphs reach one pixel into the previous cell, so each
+            # cell keeps that extra column on the left
+            cells.append(self.rasterize(" " + ch, 2 * w)[:, w - 1:])
+        
+        cells = np.stack(cells)
+        self.masks = np.ascontiguousarray(cells[:, :, 1:])
+        self.spill = np.ascontiguousarray(cells[:, :, 0])
+        
+        # A glyph's box replaces whatever the previous glyph drew in the
+        # shared column, so probe which rows each glyph's box covers by
+        # drawing it after glyphs that have ink in their last column
+        last_column = self.masks[:, :, -1] > 0
+        probes = []
+        uncovered = last_column.any(axis=0)
+        while uncovered.any():
+            best = int(np.argmax((last_column & uncovered).sum(axis=1)))
+            probes.append(best)
+            uncovered &= ~last_column[best]
+        
+        self.cover = self.spill > 0
+        for i, ch in enumerate(chars):
+            for p in probes:
+                pair = self.rasterize(chars[p] + ch, 2 * w)[:, w - 1]
+                self.cover[i] |= last_column[p] & (pair == self.spill[i])
+    
+    def rasterize(self, text, width):
+        image = Image.new("L", (width, self.cell_height), 0)
+        ImageDraw.Draw(image).text((0, 0), text, fill=255, font=self.font)
+        return np.asarray(image)
+    
+    def palette(self, fg, bg):
+        """256-entry colour table from coverage to RGB for one (fg, bg) pair"""
+        key = (fg, bg)
+        if key not in self.palettes:
+            alpha = np.arange(256, dtype=np.uint16)[:, None]
+            blended = (np.array(fg, dtype=np.uint16) * alpha + np.array(bg, dtype=np.uint16) * (255 - alpha)) // 255
+            self.palettes[key] = blended.astype(np.uint8)
+        return self.palettes[key]
+    
+    def indices(self, text):
+        """Cell indices for text, or None if it needs the slow path"""
+        if not self.monospace or not text:
+            return None
+        try:
+            codes = np.frombuffer(text.encode('ascii'), dtype=np.uint8) - self.FIRST_CHAR
+        except UnicodeEncodeError:
+            return None
+        if codes.max() > self.LAST_CHAR - self.FIRST_CHAR:
+            return None
+        return codes
+    
+    def render(self, codes):
+        """Coverage mask for a run of cells"""
+        w = self.cell_width
+        n = len(codes)
+        strip = self.masks[codes].transpose(1, 0, 2).reshape(self.cell_height, n * w)
+        if n > 1:
+            # Spill columns land in the last column of the preceding cell;
+            # ImageDraw clips the first glyph's spill at the origin
+            edges = strip[:, w - 1:(n - 1) * w:w]
+            following = codes[1:]
+            edges[...] = np.where(self.cover[following].T, self.spill[following].T, edges)
+        return strip
+    
+    def strip_image(self, text, fg, bg):
+        """Rendered line of text as an Image, reused across frames"""
+        key = (text, fg, bg)
+        image = self.strips.get(key)
+        if image is None:
+            codes = self.indices(text)
+            if codes is None:
+                return None
+            strip = self.render(codes)
+            if bg is not None:
+                image = Image.fromarray(self.palette(fg, bg)[strip], "RGB")
+            else:
+                image = Image.fromarray(strip, "L")
+            if len(self.strips) >= self.max_strips:
+                self.strips.clear()
+            self.strips[key] = image
+        return image
+    
+    def draw(self, image, xy, text, fg, bg=None):
+        """Paste text into image; returns False if the caller must rasterize it"""
+        strip = self.strip_image(text, fg if bg is not None else None, bg)
+        if strip is None:
+            return False
+        
+        x, y = xy
+        if bg is not None:
+            image.paste(strip, (x, y))
+        else:
+            image.paste(fg, (x, y, x + strip.width, y + strip.height), strip)
+        return True
+
+class Channel:
+    """Handoff from any number of producer threads to the single loop consumer
+    
+    Producers append to a deque and the consumer drains it in one batch.
+    deque.append and popleft are atomic, so no side ever takes a lock.
+    A wake byte goes into the pipe only when the consumer has said it is
+    about to wait, so a burst costs one write instead of one per item.
+    Producers racing on that flag can at worst write a spare byte, and
+    the consumer re-arms before its last look, so no wakeup is lost.
+    With several producers maxlen is a soft limit.
+    """
+    
+    def __init__(self, maxlen=None):
+        self.items = collections.deque()
+        self.maxlen = maxlen
+        self.dropped = 0    # items refused while full; drain() reports new ones
+        self.reported = 0
+        self.armed = True   # consumer is (or will be) waiting on the pipe
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+    
+    def fileno(self):
+        return self.read_fd
+    
+    def put(self, item):
+        """Publish item from any thread; never blocks"""
+        if self.maxlen is not None and len(self.items) >= self.maxlen:
+            self.dropped += 1
+            return False
+        self.items.append(item)
+        if self.armed:
+            self.armed = False
+            try:
+                os.write(self.write_fd, b'\0')
+            except BlockingIOError:
+                pass  # the consumer already has a wakeup pending
+        return True
+    
+    def drain(self):
+        """Everything published so far, oldest first (consumer side)"""
+        try:
+            while os.read(self.read_fd, 512):
+                pass
+        except BlockingIOError:
+            pass
+        
+        if self.dropped != self.reported:
+            print(f"Channel full: dropped {self.dropped - self.reported} item(s)")
+            self.reported = self.dropped
+        
+        batch = []
+        while True:
+            while self.items:
+                batch.append(self.items.popleft())
+            self.armed = True
+            # An item published before the producer saw armed has no wake
+            # byte behind it, so look once more before going back to sleep
+            if not self.items:
+                return batch
+
+ButtonEvent = collections.namedtuple('ButtonEvent', ['time', 'pin', 'pressed'])
+
+class ButtonInput:
+    """GPIO edge detection feeding a channel of debounced, timestamped button events
+    
+    The main loop waits on fileno() together with its other file
+    descriptors. Edges arrive on the GPIO thread and on settle timers; the
+    lock guards each pin's level and debounce state between them, so a
+    pin's events always alternate press/release in order.
+    """
+    
+    def __init__(self, pins, debounce=0.03):
+        self.debounce = debounce
+        self.events = Channel(maxlen=256)
+        self.lock = threading.Lock()
+        self.level = {}
+        self.changed_at = {}
+        self.settling = set()
+        
+        for pin in pins:
+            self.level[pin] = GPIO.input(pin)
+            self.changed_at[pin] = 0
+            GPIO.add_event_detect(pin, GPIO.BOTH, callback=self.on_edge)
+    
+    def on_edge(self, pin):
+        """Called from the GPIO thread on every edge, bounces included"""
+        now = time.monotonic()
+        with self.lock:
+            settle = self.changed_at[pin] + self.debounce - now
+            if settle > 0:
+                # Contact bounce: look at the pin again once it has settled,
+                # so a release inside the window is never lost
+                if pin not in self.settling:
+                    self.settling.add(pin)
+                    timer = threading.Timer(settle, self.on_settled, args=(pin,))
+                    timer.daemon = True
+                    timer.start()
+                return
+            
+            level = GPIO.input(pin)
+            if level == self.level[pin]:
+                return
+            self.level[pin] = level
+            self.changed_at[pin] = now
+            self.events.put(ButtonEvent(now, pin, level == GPIO.LOW))
+    
+    def on_settled(self, pin):
+        with self.lock:
+            self.settling.discard(pin)
+        self.on_edge(pin)
+    
+    def fileno(self):
+        return self.events.fileno()
+    
+    def pending(self):
+        """The events queued since the last call"""
+        return self.events.drain()
+
+InputEvent = collections.namedtuple('InputEvent', ['kind', 'pin', 'time', 'step', 'duration', 'modifier', 'chorded'],
+                                    defaults=(1, 0.0, None, False))
+
+PRESS = 'press'
+RELEASE = 'release'
+REPEAT = 'repeat'
+LONG_PRESS = 'long_press'
+CHORD = 'chord'
+
+class InputEvents:
+    """Turns debounced button edges into press, release, repeat, long-press and chord events
+    
+    Runs on the loop thread and calls handler(InputEvent). A held repeat
+    pin repeats after REPEAT_DELAY, each gap shorter than the last, and the
+    step a repeat carries doubles every REPEAT_STEP_EVERY repeats so long
+    scrolls stay one held press. Pins in long_press report once when held
+    that long. Pressing a pin while a modifier is held gives a chord
+    instead of a press, and the modifier's release is then marked chorded.
+    """
+    
+    def __init__(self, loop, handler, repeat_pins=(), modifiers=(), long_press=None):
+        self.loop = loop
+        self.handler = handler
+        self.repeat_pins = set(repeat_pins)
+        self.modifiers = set(modifiers)
+        self.long_press = dict(long_press or {})
+        self.pressed_at = {}
+        self.timers = {}
+        self.repeats = {}
+        self.chorded = set()
+    
+    def feed(self, event):
+        if event.pressed:
+            self.on_press(event)
+        else:
+            self.on_release(event)
+    
+    def on_press(self, event):
+        pin = event.pin
+        if pin in self.pressed_at:
+            return
+        held = [modifier for modifier in self.modifiers if modifier in self.pressed_at]
+        self.pressed_at[pin] = event.time
+        
+        if held:
+            modifier = held[0]
+            self.chorded.add(modifier)
+            self.cancel(modifier)  # a chord is never also a long press
+            self.handler(InputEvent(CHORD, pin, event.time, modifier=modifier))
+            return
+        
+        self.handler(InputEvent(PRESS, pin, event.time))
+        if pin in self.repeat_pins:
+            self.repeats[pin] = 0
+            self.timers[pin] = self.loop.call_later(REPEAT_DELAY, lambda: self.on_repeat(pin))
+        elif pin in self.long_press:
+            self.timers[pin] = self.loop.call_later(self.long_press[pin], lambda: self.on_long_press(pin))
+    
+    def on_release(self, event):
+        pin = event.pin
+        start = self.pressed_at.pop(pin, None)
+        if start is None:
+            return
+        self.cancel(pin)
+        chorded = pin in self.chorded
+        self.chorded.discard(pin)
+        self.handler(InputEvent(RELEASE, pin, event.time, duration=event.time - start, chorded=chorded))
+    
+    def on_repeat(self, pin):
+        count = self.repeats[pin] + 1
+        self.repeats[pin] = count
+        step = min(REPEAT_MAX_STEP, 1 << (count // REPEAT_STEP_EVERY))
+        interval = max(REPEAT_FASTEST, REPEAT_INTERVAL * REPEAT_ACCELERATION ** (count - 1))
+        self.timers[pin] = self.loop.call_later(interval, lambda: self.on_repeat(pin))
+        self.handler(InputEvent(REPEAT, pin, time.monotonic(), step=step))
+    
+    def on_long_press(self, pin):
+        self.timers.pop(pin, None)
+        now = time.monotonic()
+        self.handler(InputEvent(LONG_PRESS, pin, now, duration=now - self.pressed_at[pin]))
+    
+    def cancel(self, pin):
+        self.loop.cancel(self.timers.pop(pin, None))
+
+class EventLoop:
+    """Single-threaded loop multiplexing file descriptors and timers
+    
+    Callbacks run on the thread that calls run_once(). Other threads hand
+    work over with call_soon_threadsafe(), which goes through a Channel.
+    """
+    
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.timers = []
+        self.timer_seq = itertools.count()
+        self.calls = Channel()
+        self.add_reader(self.calls.fileno(), self.run_calls)
+    
+    def add_reader(self, fd, callback):
+        self.selector.register(fd, selectors.EVENT_READ, callback)
+    
+    def remove_reader(self, fd):
+        try:
+            self.selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+    
+    def call_later(self, delay, callback):
+        """Run callback after delay seconds; returns a handle for cancel()"""
+        timer = [time.monotonic() + delay, next(self.timer_seq), callback]
+        heapq.heappush(self.timers, timer)
+        return timer
+    
+    def cancel(self, timer):
+        if timer is not None:
+            timer[2] = None
+    
+    def call_soon_threadsafe(self, callback):
+        self.calls.put(callback)
+    
+    def run_calls(self):
+        for callback in self.calls.drain():
+            self.dispatch(callback)
+    
+    def dispatch(self, callback):
+        """Run one callback; a failing handler is logged and the loop carries on"""
+        try:
+            callback()
+        except Exception:
+            traceback.print_exc()
+    
+    def run_once(self):
+        """Wait for the next fd event or timer and run everything that is due"""
+        while self.timers and self.timers[0][2] is None:
+            heapq.heappop(self.timers)
+        
+        if self.timers:
+            timeout = max(0, self.timers[0][0] - time.monotonic())
+        else:
+            timeout = None
+        
+        for key, _ in self.selector.select(timeout):
+            self.dispatch(key.data)
+        
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            timer = heapq.heappop(self.timers)
+            if timer[2] is not None:
+                self.dispatch(timer[2])
+
+class Worker:
+    """Runs blocking jobs (nmcli and friends) on a small thread pool
+    
+    done(result) is called back on the loop thread. A job submitted under
+    a key that is still queued or running is dropped, so periodic
+    refreshes never pile up behind a slow one.
+    """
+    
+    def __init__(self, loop, workers=3):
+        self.loop = loop
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.active = set()
+    
+    def busy(self, key):
+        return key in self.active
+    
+    def submit(self, key, job, done=None):
+        if key in self.active:
+            return False
+        self.active.add(key)
+        
+        def run():
+            try:
+                result = job()
+            except Exception:
+                result = None
+            self.loop.call_soon_threadsafe(lambda: self.finish(key, done, result))
+        
+        self.executor.submit(run)
+        return True
+    
+    def finish(self, key, done, result):
+        self.active.discard(key)
+        if done is not None:
+            done(result)
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class NmcliWifi:
+    """WiFi operations through the nmcli command line; all calls block
+    
+    Changes go through sudo, so they work for a service user without a
+    login session; each returns True if nmcli succeeded.
+    """
+    
+    pushes_updates = False
+    
+    def status(self, wlan):
+        """(enabled, connected SSID or None)"""
+        try:
+            result = subprocess.run(['nmcli', 'device', 'show', wlan],
+                                  capture_output=True, text=True, timeout=2)
+            if 'connected' not in result.stdout.lower():
+                return False, None
+            
+            conn_result = subprocess.run(['nmcli', '-t', '-f', 'ACTIVE,SSID', 
+                                         'device', 'wifi', 'list', 'ifname', wlan],
+                                        capture_output=True, text=True, timeout=2)
+            for line in conn_result.stdout.strip().split('\n'):
+                if line.startswith('yes:'):
+                    return True, line.split(':', 1)[1]
+            return True, None
+        except:
+            return False, None
+    
+    def scan(self, wlan):
+        """Visible networks, strongest first, one entry per SSID"""
+        try:
+            # --rescan yes waits for the scan to finish instead of sleeping
+            result = subprocess.run(['sudo', 'nmcli', '-t', '-f', 'SSID,SIGNAL', 'device', 'wifi', 
+                                   'list', '--rescan', 'yes', 'ifname', wlan],
+                                  capture_output=True, text=True, timeout=15)
+        except:
+            return []
+        
+        seen = {}
+        for line in result.stdout.strip().split('\n'):
+            if line and ':' in line:
+                parts = line.split(':')
+                if len(parts) >= 2 and parts[0] and parts[1].isdigit():
+                    net = {'ssid': parts[0], 'signal': parts[1]}
+                    if net['ssid'] not in seen or int(net['signal']) > int(seen[net['ssid']]['signal']):
+                        seen[net['ssid']] = net
+        return sorted(seen.values(), key=lambda x: int(x['signal']), reverse=True)
+    
+    def nmcli(self, args, timeout=5):
+        try:
+            subprocess.run(['sudo', 'nmcli'] + args, timeout=timeout, check=True)
+            return True
+        except:
+            return False
+    
+    def set_radio(self, on):
+        """The WiFi radio switch, which is global: every interface follows it"""
+        return self.nmcli(['radio', 'wifi', 'on' if on else 'off'])
+    
+    def connect(self, wlan, ssid, password):
+        """True once the connection is up"""
+        return self.nmcli(['device', 'wifi', 'connect', ssid, 'password', password, 'ifname', wlan],
+                          timeout=15)
+    
+    def disconnect(self, wlan):
+        return self.nmcli(['device', 'disconnect', wlan])
+
+class NetworkManagerWifi:
+    """WiFi operations over NetworkManager's D-Bus API, same interface as NmcliWifi
+    
+    Calls still block and run on the worker, but each is a round trip on
+    an open socket instead of a fork. A listener thread subscribes to
+    access point, device state and property signals and reports what
+    changed through notify(kind, wlan), so scan results and connection
+    state are pushed instead of polled. bus may be a bus address, e.g. a
+    test bus running a mock service.
+    
+    Reads and signals are open to anyone, but polkit refuses changes to a
+    service user without a login session; a refused change is handed to
+    NmcliWifi, which goes through sudo.
+    """
+    
+    SERVICE = 'org.freedesktop.NetworkManager'
+    ROOT = '/org/freedesktop/NetworkManager'
+    DEVICE = 'org.freedesktop.NetworkManager.Device'
+    WIRELESS = 'org.freedesktop.NetworkManager.Device.Wireless'
+    ACCESS_POINT = 'org.freedesktop.NetworkManager.AccessPoint'
+    ACTIVE_CONNECTION = 'org.freedesktop.NetworkManager.Connection.Active'
+    SETTINGS_CONNECTION = 'org.freedesktop.NetworkManager.Settings.Connection'
+    
+    # NMDeviceState values
+    STATE_UNAVAILABLE = 20
+    STATE_ACTIVATED = 100
+    
+    # NMActiveConnectionState values
+    ACTIVE_ACTIVATED = 2
+    ACTIVE_DEACTIVATED = 4
+    
+    def __init__(self, notify, bus='SYSTEM'):
+        self.notify = notify
+        self.bus = bus
+        self.lock = threading.Lock()
+        self.devices = {}   # interface name -> device object path
+        self.fallback = NmcliWifi()
+        self.conn = open_dbus_connection(bus=bus)
+        self.call(self.ROOT, self.SERVICE, 'GetDevices')  # fails here if NetworkManager is not running
+        self.pushes_updates = True
+        threading.Thread(target=self.listen, daemon=True).start()
+    
+    def send(self, message):
+        with self.lock:
+            return unwrap_msg(self.conn.send_and_get_reply(message, timeout=10))
+    
+    def call(self, path, interface, method, signature=None, body=()):
+        address = DBusAddress(path, bus_name=self.SERVICE, interface=interface)
+        return self.send(new_method_call(address, method, signature, body))
+    
+    def get(self, path, interface, name):
+        address = DBusAddress(path, bus_name=self.SERVICE, interface=interface)
+        return self.send(Properties(address).get(name))[0][1]
+    
+    def device(self, wlan):
+        if wlan not in self.devices:
+            self.devices[wlan] = self.call(self.ROOT, self.SERVICE, 'GetDeviceByIpIface', 's', (wlan,))[0]
+        return self.devices[wlan]
+    
+    def status(self, wlan):
+        """(enabled, connected SSID or None)"""
+        try:
+            device = self.device(wlan)
+            state = self.get(device, self.DEVICE, 'State')
+            if state <= self.STATE_UNAVAILABLE:
+                return False, None
+            if state != self.STATE_ACTIVATED:
+                return True, None
+            ap = self.get(device, self.WIRELESS, 'ActiveAccessPoint')
+            if ap == '/':
+                return True, None
+            return True, bytes(self.get(ap, self.ACCESS_POINT, 'Ssid')).decode('utf-8', 'replace')
+        except Exception:
+            self.devices.pop(wlan, None)
+            return False, None
+    
+    def access_point_list(self, wlan):
+        """(path, ssid, strength) for every access point the device knows"""
+        result = []
+        for path in self.call(self.device(wlan), self.WIRELESS, 'GetAllAccessPoints')[0]:
+            address = DBusAddress(path, bus_name=self.SERVICE, interface=self.ACCESS_POINT)
+            props = self.send(Properties(address).get_all())[0]
+            ssid = bytes(props['Ssid'][1]).decode('utf-8', 'replace')
+            result.append((path, ssid, props['Strength'][1]))
+        return result
+    
+    def access_points(self, wlan):
+        """Known networks, strongest first, one entry per SSID, without a new scan"""
+        try:
+            points = self.access_point_list(wlan)
+        except Exception:
+            return []
+        best = {}
+        for _, ssid, strength in points:
+            if ssid and strength > best.get(ssid, -1):
+                best[ssid] = strength
+        return [{'ssid': ssid, 'signal': str(strength)}
+                for ssid, strength in sorted(best.items(), key=lambda item: item[1], reverse=True)]
+    
+    def scan(self, wlan):
+        try:
+            self.call(self.device(wlan), self.WIRELESS, 'RequestScan', 'a{sv}', ({},))
+        except Exception:
+            pass  # e.g. a scan ran moments ago; AccessPointAdded signals follow anyway
+        return self.access_points(wlan)
+    
+    def set_radio(self, on):
+        """The global WirelessEnabled switch, as nmcli radio wifi"""
+        try:
+            address = DBusAddress(self.ROOT, bus_name=self.SERVICE, interface=self.SERVICE)
+            self.send(Properties(address).set('WirelessEnabled', 'b', on))
+            return True
+        except Exception:
+            return self.fallback.set_radio(on)
+    
+    def connect(self, wlan, ssid, password, timeout=15):
+        """True once the device is activated on ssid"""
+        try:
+            device = self.device(wlan)
+            ap = next((path for path, name, _ in self.access_point_list(wlan) if name == ssid), '/')
+            settings = {
+                '802-11-wireless': {'ssid': ('ay', ssid.encode())},
+                '802-11-wireless-security': {'key-mgmt': ('s', 'wpa-psk'), 'psk': ('s', password)},
+            }
+            profile, active = self.call(self.ROOT, self.SERVICE, 'AddAndActivateConnection',
+                                        'a{sa{sv}}oo', (settings, device, ap))
+        except Exception:
+            return self.fallback.connect(wlan, ssid, password)
+        
+        # Follow this activation rather than the device, which may still be
+        # up on another network; a failed one is dropped off the bus
+        try:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                state = self.get(active, self.ACTIVE_CONNECTION, 'State')
+                if state == self.ACTIVE_ACTIVATED:
+                    return True
+                if state == self.ACTIVE_DEACTIVATED:
+                    break
+                time.sleep(0.25)
+        except Exception:
+            pass
+        # Like nmcli, don't keep a profile that never came up, e.g. a wrong password
+        try:
+            self.call(profile, self.SETTINGS_CONNECTION, 'Delete')
+        except Exception:
+            pass
+        return False
+    
+    def disconnect(self, wlan):
+        try:
+            self.call(self.device(wlan), self.DEVICE, 'Disconnect')
+            return True
+        except Exception:
+            return self.fallback.disconnect(wlan)
+    
+    def interface_for(self, path):
+        for wlan, device in list(self.devices.items()):
+            if device == path:
+                return wlan
+        return None
+    
+    def listen(self):
+        """Listener thread: NetworkManager signals become notify(kind, wlan) calls"""
+        try:
+            conn = open_dbus_connection(bus=self.bus)
+            rules = [
+                MatchRule(type='signal', sender=self.SERVICE, interface=self.WIRELESS, member='AccessPointAdded'),
+                MatchRule(type='signal', sender=self.SERVICE, interface=self.WIRELESS, member='AccessPointRemoved'),
+                MatchRule(type='signal', sender=self.SERVICE, interface=self.DEVICE, member='StateChanged'),
+                MatchRule(type='signal', sender=self.SERVICE, interface='org.freedesktop.DBus.Properties',
+                          member='PropertiesChanged', path_namespace=self.ROOT),
+            ]
+            for rule in rules:
+                conn.send_and_get_reply(message_bus.AddMatch(rule), timeout=10)
+            
+            while True:
+                msg = conn.receive()
+                member = msg.header.fields.get(HeaderFields.member)
+                wlan = self.interface_for(msg.header.fields.get(HeaderFields.path))
+                if member in ('AccessPointAdded', 'AccessPointRemoved'):
+                    if wlan:
+                        self.notify('networks', wlan)
+                elif member == 'StateChanged':
+                    if wlan:
+                        self.notify('status', wlan)
+                elif member == 'PropertiesChanged':
+                    interface, changed = msg.body[0], msg.body[1]
+                    if interface == self.WIRELESS and 'ActiveAccessPoint' in changed and wlan:
+                        self.notify('status', wlan)
+                    elif interface == self.SERVICE and 'WirelessEnabled' in changed:
+                        self.notify('status', None)
+        except Exception:
+            # No more pushes; the UI goes back to polling
+            self.pushes_updates = False
+
+class LinkMonitor:
+    """rtnetlink listener for network interfaces appearing, vanishing and changing state
+    
+    The nonblocking socket is read from the event loop, so a WiFi dongle
+    plugged in later or a dropped link shows up as it happens.
+    """
+    
+    RTMGRP_LINK = 1
+    RTM_NEWLINK = 16
+    RTM_DELLINK = 17
+    IFLA_IFNAME = 3
+    IFLA_OPERSTATE = 16
+    IF_OPER_UP = 6
+    
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_NONBLOCK,
+                                  socket.NETLINK_ROUTE)
+        self.sock.bind((0, self.RTMGRP_LINK))
+    
+    def fileno(self):
+        return self.sock.fileno()
+    
+    def read(self):
+        """(name, present, up) for every waiting link message; None if some were lost"""
+        events = []
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                return events
+            except OSError:
+                return None  # ENOBUFS: the kernel dropped messages
+            
+            offset = 0
+            while offset + 16 <= len(data):
+                length, msg_type = struct.unpack_from('=LH', data, offset)
+                if length < 16:
+                    break
+                if msg_type in (self.RTM_NEWLINK, self.RTM_DELLINK):
+                    name, operstate = self.parse_link(data, offset + 16, offset + length)
+                    if name:
+                        events.append((name, msg_type == self.RTM_NEWLINK, operstate == self.IF_OPER_UP))
+                offset += (length + 3) & ~3
+    
+    def parse_link(self, data, start, end):
+        # Attributes follow the 16-byte struct ifinfomsg
+        pos = start + 16
+        name = operstate = None
+        while pos + 4 <= end:
+            rta_len, rta_type = struct.unpack_from('=HH', data, pos)
+            if rta_len < 4:
+                break
+            if rta_type == self.IFLA_IFNAME:
+                name = data[pos + 4:pos + rta_len].split(b'\0', 1)[0].decode('ascii', 'replace')
+            elif rta_type == self.IFLA_OPERSTATE:
+                operstate = data[pos + 4]
+            pos += (rta_len + 3) & ~3
+        return name, operstate
+
+class SystemInfo:
+    """System facts read straight from /proc and /sys, each cached for its own TTL
+    
+    Nothing here forks, so the About screen can refresh every second.
+    """
+    
+    # field: seconds a value stays fresh (None = never changes)
+    TTL = {
+        'model': None,
+        'firmware': None,
+        'temp': 1,
+        'uptime': 10,
+    }
+    
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+    
+    def get(self, field):
+        now = time.monotonic()
+        if now >= self.expires.get(field, 0):
+            try:
+                self.values[field] = getattr(self, 'read_' + field)()
+            except:
+                self.values[field] = 'N/A'
+            ttl = self.TTL[field]
+            self.expires[field] = float('inf') if ttl is None else now + ttl
+        return self.values[field]
+    
+    def snapshot(self):
+        return {field: self.get(field) for field in self.TTL}
+    
+    def read_model(self):
+        try:
+            with open('/proc/device-tree/model', 'r') as f:
+                return f.read().strip().replace('\x00', '')
+        except OSError:
+            return 'Unknown'
+    
+    def read_firmware(self):
+        return os.uname().release
+    
+    def read_temp(self):
+        with open('/sys/class/thermal/thermal_zone0/temp') as f:
+            return f"temp={int(f.read()) / 1000:.1f}'C"
+    
+    def read_uptime(self):
+        with open('/proc/uptime') as f:
+            minutes = int(float(f.read().split()[0])) // 60
+        days, minutes = divmod(minutes, 1440)
+        hours, minutes = divmod(minutes, 60)
+        if days:
+            return f"up {days}d {hours}h {minutes}m"
+        if hours:
+            return f"up {hours}h {minutes}m"
+        return f"up {minutes} min"
+
+class MetricRing:
+    """Fixed-size ring of float samples in an array"""
+    
+    def __init__(self, size=METRIC_SAMPLES):
+        self.data = array('f', [0.0]) * size
+        self.head = 0
+        self.count = 0
+    
+    def push(self, value):
+        self.data[self.head] = value
+        self.head = (self.head + 1) % len(self.data)
+        self.count = min(self.count + 1, len(self.data))
+    
+    def last(self):
+        return self.data[self.head - 1] if self.count else 0.0
+    
+    def values(self):
+        """Oldest to newest"""
+        start = self.head - self.count
+        if start >= 0:
+            return self.data[start:self.head]
+        return self.data[start:] + self.data[:self.head]
+
+class MetricsSampler:
+    """Samples CPU, load, memory, temperature, throttling and network traffic once a second
+    
+    The source files are opened once and re-read with os.pread, and each
+    sample is a handful of small parses driven by an event loop timer, so
+    history builds up on every screen for next to no CPU.
+    """
+    
+    PATHS = {
+        'stat': '/proc/stat',
+        'loadavg': '/proc/loadavg',
+        'meminfo': '/proc/meminfo',
+        'netdev': '/proc/net/dev',
+        'temp': '/sys/class/thermal/thermal_zone0/temp',
+        'throttled': '/sys/devices/platform/soc/soc:firmware/get_throttled',
+    }
+    
+    def __init__(self, loop, interval=1.0):
+        self.loop = loop
+        self.interval = interval
+        self.fds = {}
+        for name, path in self.PATHS.items():
+            try:
+                self.fds[name] = os.open(path, os.O_RDONLY)
+            except OSError:
+                pass
+        
+        self.cpu = MetricRing()
+        self.load = MetricRing()
+        self.mem = MetricRing()
+        self.temp = MetricRing()
+        self.net = MetricRing()   # bytes per second, both directions
+        self.throttled = None
+        
+        self.cpu_times = None
+        self.net_bytes = None
+        self.net_time = None
+        self.listeners = []
+        self.timer = None
+    
+    def start(self):
+        self.sample()
+    
+    def stop(self):
+        self.loop.cancel(self.timer)
+        self.timer = None
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+    
+    def read(self, name, size=4096):
+        fd = self.fds.get(name)
+        if fd is None:
+            return None
+        try:
+            return os.pread(fd, size, 0)
+        except OSError:
+            return None
+    
+    def sample(self):
+        self.timer = self.loop.call_later(self.interval, self.sample)
+        try:
+            self.collect()
+        except:
+            pass
+        for listener in self.listeners:
+            listener()
+    
+    def collect(self):
+        data = self.read('stat', 512)
+        if data:
+            times = [int(v) for v in data.split(b'\n', 1)[0].split()[1:9]]
+            if self.cpu_times:
+                deltas = [now - before for now, before in zip(times, self.cpu_times)]
+                total = sum(deltas)
+                idle = deltas[3] + deltas[4]  # idle + iowait
+                self.cpu.push(100.0 * (total - idle) / total if total else 0.0)
+            self.cpu_times = times
+        
+        data = self.read('loadavg', 128)
+        if data:
+            self.load.push(float(data.split()[0]))
+        
+        data = self.read('meminfo')
+        if data:
+            fields = {}
+            for line in data.split(b'\n'):
+                key, _, rest = line.partition(b':')
+                if key in (b'MemTotal', b'MemAvailable'):
+                    fields[key] = int(rest.split()[0])
+            total = fields.get(b'MemTotal')
+            if total and b'MemAvailable' in fields:
+                self.mem.push(100.0 * (total - fields[b'MemAvailable']) / total)
+        
+        data = self.read('temp', 32)
+        if data:
+            self.temp.push(int(data) / 1000)
+        
+        data = self.read('throttled', 32)
+        if data:
+            self.throttled = int(data, 16)
+        
+        data = self.read('netdev', 16384)
+        if data:
+            now = time.monotonic()
+            total = 0
+            for line in data.split(b'\n')[2:]:
+                iface, _, counters = line.partition(b':')
+                iface = iface.strip()
+                if iface and iface != b'lo':
+                    counters = counters.split()
+                    total += int(counters[0]) + int(counters[8])
+            if self.net_bytes is not None and now > self.net_time:
+                self.net.push(max(0, total - self.net_bytes) / (now - self.net_time))
+            self.net_bytes = total
+            self.net_time = now
+    
+    def throttle_state(self):
+        """Short description of get_throttled, None when it can't be read"""
+        flags = self.throttled
+        if flags is None:
+            return None
+        if flags & 0x4:
+            return "THROTTLED"
+        if flags & 0x1:
+            return "Under-voltage"
+        if flags & 0x8:
+            return "Temp limited"
+        if flags & 0x2:
+            return "Freq capped"
+        if flags & 0xF0000:
+            return "OK (was limited)"
+        return "OK"
+
+class Scrollback:
+    """Fixed-capacity ring of logical text lines stored as UTF-8 in one bytearray
+    
+    Line i is found through the starts/lengths index in O(1). When either
+    the line limit or the byte budget is reached the oldest lines are
+    dropped, so memory stays flat however much output arrives.
+    
+    Lines are kept unwrapped. A prefix sum of wrapped row counts
+    (row_starts) maps a screen row to its line with a binary search, and only
+    the rows being drawn are ever sliced out.
+    """
+    
+    def __init__(self, max_lines=SCROLLBACK_LINES, max_bytes=SCROLLBACK_BYTES, wrap_width=TERM_COLS):
+        self.max_lines = max_lines
+        self.capacity = max_bytes
+        self.wrap_width = wrap_width
+        self.data = bytearray(max_bytes)
+        self.starts = array('L', [0]) * max_lines
+        self.lengths = array('L', [0]) * max_lines
+        self.chars = array('L', [0]) * max_lines
+        self.row_starts = array('Q', [0]) * max_lines
+        self.head = 0       # index slot of the oldest line
+        self.count = 0
+        self.write_pos = 0  # next free byte in data
+        self.used = 0
+        self.next_row = 0   # wrapped rows appended so far, including dropped ones
+    
+    def __len__(self):
+        return self.count
+    
+    def __bool__(self):
+        return self.count > 0
+    
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.write_pos = 0
+        self.used = 0
+        self.next_row = 0
+    
+    def slot(self, index):
+        return (self.head + index) % self.max_lines
+    
+    def line_rows(self, chars):
+        return max(1, -(-chars // self.wrap_width))
+    
+    def drop_oldest(self):
+        self.used -= self.lengths[self.head]
+        self.head = (self.head + 1) % self.max_lines
+        self.count -= 1
+    
+    def push(self, line):
+        encoded = line.encode('utf-8')
+        if len(encoded) > self.capacity:
+            encoded = encoded[:self.capacity]
+            line = encoded.decode('utf-8', errors='ignore')
+        n = len(encoded)
+        while self.count and (self.count == self.max_lines or self.used + n > self.capacity):
+            self.drop_oldest()
+        
+        # Copy into the ring, wrapping around the end of the buffer
+        start = self.write_pos
+        first = min(n, self.capacity - start)
+        self.data[start:start + first] = encoded[:first]
+        if first < n:
+            self.data[0:n - first] = encoded[first:]
+        
+        slot = self.slot(self.count)
+        self.starts[slot] = start
+        self.lengths[slot] = n
+        self.chars[slot] = len(line)
+        self.row_starts[slot] = self.next_row
+        self.next_row += self.line_rows(len(line))
+        self.write_pos = (start + n) % self.capacity
+        self.used += n
+        self.count += 1
+    
+    def pop(self):
+        """Remove and return the newest line"""
+        line = self.line(self.count - 1)
+        slot = self.slot(self.count - 1)
+        self.count -= 1
+        self.used -= self.lengths[slot]
+        self.write_pos = self.starts[slot]
+        self.next_row = self.row_starts[slot]
+        return line
+    
+    def append(self, line):
+        self.push(line)
+    
+    def line(self, index):
+        slot = self.slot(index)
+        start = self.starts[slot]
+        end = start + self.lengths[slot]
+        if end <= self.capacity:
+            raw = self.data[start:end]
+        else:
+            raw = self.data[start:] + self.data[:end - self.capacity]
+        return raw.decode('utf-8', errors='replace')
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.line(i) for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("scrollback index out of range")
+        return self.line(index)
+    
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.line(i)
+    
+    # ---- wrapped rows ----
+    
+    def set_wrap_width(self, width):
+        """Change the wrap width; the row index is rebuilt once, the text is untouched"""
+        if width == self.wrap_width:
+            return
+        self.wrap_width = width
+        row = self.row_starts[self.head] if self.count else 0
+        for i in range(self.count):
+            slot = self.slot(i)
+            self.row_starts[slot] = row
+            row += self.line_rows(self.chars[slot])
+        self.next_row = row
+    
+    def total_rows(self):
+        if not self.count:
+            return 0
+        return self.next_row - self.row_starts[self.head]
+    
+    def find_row(self, row):
+        """Index of the line containing wrapped row (relative to the oldest line)"""
+        target = self.row_starts[self.head] + row
+        lo, hi = 0, self.count - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.row_starts[self.slot(mid)] <= target:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+    
+    def rows(self, start, end):
+        """Wrapped rows [start, end), sliced out of only the lines they fall in"""
+        end = min(end, self.total_rows())
+        if start >= end:
+            return []
+        
+        width = self.wrap_width
+        out = []
+        index = self.find_row(start)
+        skip = self.row_starts[self.head] + start - self.row_starts[self.slot(index)]
+        while len(out) < end - start:
+            text = self.line(index)
+            for offset in range(skip * width, max(len(text), 1), width):
+                out.append(text[offset:offset + width])
+                if len(out) == end - start:
+                    break
+            skip = 0
+            index += 1
+        return out
+
+class TerminalScreen:
+    """Incremental VT100/ANSI interpreter over a fixed character grid
+    
+    Text is fed in arbitrary chunks; escape sequences split across chunks
+    are carried over in the parser state. Rows scrolling off the top of the
+    grid go to the scrollback, rejoined into logical lines when they were
+    soft-wrapped, so \r progress bars overwrite in place and full-screen
+    programs draw into the grid.
+    """
+    
+    GROUND, ESCAPE, CSI, OSC, OSC_ESCAPE, CHARSET = range(6)
+    PRINTABLE = re.compile(r'[^\x00-\x1f\x7f]+')
+    PLAIN_LINES = re.compile(r'(?:[^\x00-\x1f\x7f]*\r\n)+')
+    CSI_BODY = re.compile(r'[\x20-\x3f]*')
+    OSC_BODY = re.compile(r'[^\x07\x1b]*')
+    
+    def __init__(self, scrollback, cols=TERM_COLS, rows=TERM_ROWS, respond=None):
+        self.scrollback = scrollback
+        self.cols = cols
+        self.rows = rows
+        self.respond = respond      # called with bytes for device status replies
+        self.osc_handler = None     # called with (code, value) for other OSC strings
+        self.reset()
+    
+    def reset(self):
+        self.scrollback.clear()
+        self.grid = [[' '] * self.cols for _ in range(self.rows)]
+        self.wrapped = [False] * self.rows
+        self.saved_grid = None      # main screen while the alternate one is shown
+        self.continues_line = False
+        self.x = 0
+        self.y = 0
+        self.soft_reset()
+    
+    def soft_reset(self):
+        """Back to sane modes, e.g. after a program dies mid-sequence"""
+        if self.saved_grid is not None:
+            self.set_alternate_screen(False)
+        self.state = self.GROUND
+        self.params = ""
+        self.pending_wrap = False
+        self.saved_cursor = (0, 0)
+        self.top = 0
+        self.bottom = self.rows - 1
+        self.autowrap = True
+        self.cursor_visible = True
+    
+    # ---- display ----
+    
+    def used_rows(self):
+        """Grid rows that hold something worth showing"""
+        if self.saved_grid is not None:
+            return self.rows
+        for y in range(self.rows - 1, -1, -1):
+            if ''.join(self.grid[y]).strip():
+                return y + 1
+        return 0
+    
+    def scrollback_rows(self):
+        return 0 if self.saved_grid is not None else self.scrollback.total_rows()
+    
+    def total_rows(self):
+        return self.scrollback_rows() + self.used_rows()
+    
+    def cursor_row(self):
+        """Display row of the cursor, or None while it is hidden or on a blank row"""
+        if not self.cursor_visible or self.y >= self.used_rows():
+            return None
+        return self.scrollback_rows() + self.y
+    
+    def display_rows(self, start, end):
+        """Rows [start, end) of scrollback followed by the grid"""
+        history = self.scrollback_rows()
+        out = self.scrollback.rows(start, min(end, history)) if start < history else []
+        for y in range(max(start - history, 0), min(end - history, self.used_rows())):
+            out.append(''.join(self.grid[y]).rstrip())
+        return out
+    
+    # ---- input ----
+    
+    def write_line(self, text):
+        """Print a complete line of our own, starting on a fresh line"""
+        if self.x > 0 or self.pending_wrap:
+            self.feed('\r\n')
+        self.feed(text + '\r\n')
+    
+    def feed(self, text):
+        i = 0
+        n = len(text)
+        while i < n:
+            state = self.state
+            if state == self.GROUND:
+                if self.at_fresh_bottom_line():
+                    m = self.PLAIN_LINES.match(text, i)
+                    if m:
+                        self.put_lines(m.group()[:-2].split('\r\n'))
+                        i = m.end()
+                        continue
+                m = self.PRINTABLE.match(text, i)
+                if m:
+                    self.put_text(m.group())
+                    i = m.end()
+                    continue
+                ch = text[i]
+                i += 1
+                if ch == '\x1b':
+                    self.state = self.ESCAPE
+                else:
+                    self.control(ch)
+            
+            elif state == self.ESCAPE:
+                ch = text[i]
+                i += 1
+                if ch == '[':
+                    self.state = self.CSI
+                    self.params = ""
+                elif ch == ']':
+                    self.state = self.OSC
+                    self.params = ""
+                elif ch in '()*+#%':
+                    self.state = self.CHARSET
+                else:
+                    self.state = self.GROUND
+                    self.escape(ch)
+            
+            elif state == self.CSI:
+                m = self.CSI_BODY.match(text, i)
+                self.params += m.group()
+                i = m.end()
+                if i < n:
+                    ch = text[i]
+                    self.state = self.GROUND
+                    if '@' <= ch <= '~':
+                        i += 1
+                        self.csi(ch)
+                    # anything else aborts the sequence and is handled as text
+            
+            elif state == self.OSC:
+                m = self.OSC_BODY.match(text, i)
+                self.params += m.group()
+                i = m.end()
+                if i < n:
+                    ch = text[i]
+                    i += 1
+                    if ch == '\x07':
+                        self.state = self.GROUND
+                        self.osc(self.params)
+                    else:
+                        self.state = self.OSC_ESCAPE
+            
+            elif state == self.OSC_ESCAPE:
+                # ESC \ (string terminator) ends the OSC
+                i += 1
+                self.state = self.GROUND
+                self.osc(self.params)
+            
+            else:
+                # Charset designation: ESC ( B and friends take one more byte
+                i += 1
+                self.state = self.GROUND
+    
+    def put_text(self, run):
+        start = 0
+        end = len(run)
+        while start < end:
+            if self.pending_wrap:
+                self.wrapped[self.y] = True
+                self.x = 0
+                self.linefeed()
+                self.pending_wrap = False
+            chunk = run[start:start + self.cols - self.x]
+            start += len(chunk)
+            self.grid[self.y][self.x:self.x + len(chunk)] = chunk
+            self.x += len(chunk)
+            if self.x >= self.cols:
+                self.x = self.cols - 1
+                if self.autowrap:
+                    self.pending_wrap = True
+                else:
+                    break
+    
+    def at_fresh_bottom_line(self):
+        return (self.x == 0 and self.y == self.bottom == self.rows - 1 and self.top == 0
+                and not self.pending_wrap and self.autowrap and self.saved_grid is None
+                and not self.wrapped[-1] and not ''.join(self.grid[-1]).strip())
+    
+    def put_lines(self, lines):
+        """Bulk path for whole lines streaming in at the bottom of the screen
+        
+        Same result as writing them one character at a time, but each line
+        is cut into rows once and only rows that end up on screen become
+        grid rows again.
+        """
+        cols = self.cols
+        rows = [(''.join(row), wrapped) for row, wrapped in zip(self.grid[:-1], self.wrapped[:-1])]
+        for line in lines:
+            last = (max(len(line), 1) - 1) // cols * cols
+            for start in range(0, last, cols):
+                rows.append((line[start:start + cols], True))
+            rows.append((line[last:], False))
+        rows.append(("", False))
+        
+        keep = len(rows) - self.rows
+        parts = []
+        for text, wrapped in rows[:keep]:
+            parts.append(text)
+            if not wrapped:
+                self.push_scrollback(''.join(parts), False)
+                parts = []
+        if parts:
+            self.push_scrollback(''.join(parts), True)
+        self.grid = [list(text.ljust(cols)) for text, _ in rows[keep:]]
+        self.wrapped = [wrapped for _, wrapped in rows[keep:]]
+    
+    def control(self, ch):
+        if ch == '\r':
+            self.x = 0
+            self.pending_wrap = False
+        elif ch in '\n\x0b\x0c':
+            self.linefeed()
+        elif ch == '\b':
+            self.x = max(0, self.x - 1)
+            self.pending_wrap = False
+        elif ch == '\t':
+            self.x = min(self.cols - 1, (self.x // 8 + 1) * 8)
+    
+    # ---- scrolling ----
+    
+    def blank_row(self):
+        return [' '] * self.cols
+    
+    def linefeed(self):
+        self.pending_wrap = False
+        if self.y == self.bottom:
+            self.scroll_up(1)
+        elif self.y < self.rows - 1:
+            self.y += 1
+    
+    def reverse_index(self):
+        self.pending_wrap = False
+        if self.y == self.top:
+            self.scroll_down(1)
+        elif self.y > 0:
+            self.y -= 1
+    
+    def scroll_up(self, count, top=None):
+        top = self.top if top is None else top
+        for _ in range(count):
+            row = self.grid.pop(top)
+            wrapped = self.wrapped.pop(top)
+            if top == 0 and self.saved_grid is None:
+                self.push_scrollback(''.join(row), wrapped)
+            self.grid.insert(self.bottom, self.blank_row())
+            self.wrapped.insert(self.bottom, False)
+    
+    def scroll_down(self, count, top=None):
+        top = self.top if top is None else top
+        for _ in range(count):
+            self.grid.pop(self.bottom)
+            self.wrapped.pop(self.bottom)
+            self.grid.insert(top, self.blank_row())
+            self.wrapped.insert(top, False)
+    
+    def push_scrollback(self, text, wrapped):
+        if self.continues_line and self.scrollback:
+            # The row before this one wrapped into it: rejoin the logical line
+            text = self.scrollback.pop() + text
+        if not wrapped:
+            # Trailing blanks go from the whole logical line, however it was cut into rows
+            text = text.rstrip()
+        self.scrollback.append(text)
+        self.continues_line = wrapped
+    
+    # ---- escape sequences ----
+    
+    def escape(self, ch):
+        if ch == '7':
+            self.saved_cursor = (self.x, self.y)
+        elif ch == '8':
+            self.x, self.y = self.saved_cursor
+            self.pending_wrap = False
+        elif ch == 'D':
+            self.linefeed()
+        elif ch == 'E':
+            self.x = 0
+            self.linefeed()
+        elif ch == 'M':
+            self.reverse_index()
+        elif ch == 'c':
+            self.reset()
+    
+    def osc(self, params):
+        code, _, value = params.partition(';')
+        if code in ('0', '2'):
+            return  # window title; the LCD has nowhere to show it
+        if self.osc_handler is not None:
+            self.osc_handler(code, value)
+    
+    def csi(self, final):
+        params = self.params
+        private = params[:1] in ('?', '>', '=', '<')
+        if private:
+            params = params[1:]
+        args = [int(p) if p.isdigit() else 0 for p in params.split(';')] if params else []
+        
+        def arg(index, default=1):
+            value = args[index] if index < len(args) else 0
+            return value or default
+        
+        self.pending_wrap = False
+        last_col = self.cols - 1
+        last_row = self.rows - 1
+        
+        if final == 'm':
+            return  # colours and attributes are not rendered
+        elif final == 'A':
+            self.y = max(self.top if self.y >= self.top else 0, self.y - arg(0))
+        elif final in 'Be':
+            self.y = min(self.bottom if self.y <= self.bottom else last_row, self.y + arg(0))
+        elif final in 'Ca':
+            self.x = min(last_col, self.x + arg(0))
+        elif final == 'D':
+            self.x = max(0, self.x - arg(0))
+        elif final == 'E':
+            self.x = 0
+            self.y = min(last_row, self.y + arg(0))
+        elif final == 'F':
+            self.x = 0
+            self.y = max(0, self.y - arg(0))
+        elif final in 'G`':
+            self.x = min(last_col, arg(0) - 1)
+        elif final == 'd':
+            self.y = min(last_row, arg(0) - 1)
+        elif final in 'Hf':
+            self.y = min(last_row, arg(0) - 1)
+            self.x = min(last_col, arg(1) - 1)
+        elif final == 'J':
+            self.erase_display(arg(0, 0))
+        elif final == 'K':
+            self.erase_line(arg(0, 0))
+        elif final == 'L':
+            if self.top <= self.y <= self.bottom:
+                self.scroll_down(min(arg(0), self.bottom - self.y + 1), top=self.y)
+        elif final == 'M':
+            if self.top <= self.y <= self.bottom:
+                self.scroll_up(min(arg(0), self.bottom - self.y + 1), top=self.y)
+        elif final == 'S':
+            self.scroll_up(arg(0))
+        elif final == 'T':
+            self.scroll_down(arg(0))
+        elif final == 'P':
+            row = self.grid[self.y]
+            count = min(arg(0), self.cols - self.x)
+            row[self.x:] = row[self.x + count:] + [' '] * count
+        elif final == '@':
+            row = self.grid[self.y]
+            count = min(arg(0), self.cols - self.x)
+            row[self.x:] = ([' '] * count + row[self.x:])[:self.cols - self.x]
+        elif final == 'X':
+            row = self.grid[self.y]
+            count = min(arg(0), self.cols - self.x)
+            row[self.x:self.x + count] = [' '] * count
+        elif final == 'r' and not private:
+            top = arg(0) - 1
+            bottom = min(last_row, arg(1, self.rows) - 1)
+            if top < bottom:
+                self.top, self.bottom = top, bottom
+                self.x, self.y = 0, 0
+        elif final == 's' and not private:
+            self.saved_cursor = (self.x, self.y)
+        elif final == 'u' and not private:
+            self.x, self.y = self.saved_cursor
+        elif final in 'hl' and private:
+            enable = final == 'h'
+            for mode in args:
+                if mode in (47, 1047, 1049):
+                    self.set_alternate_screen(enable)
+                elif mode == 25:
+                    self.cursor_visible = enable
+                elif mode == 7:
+                    self.autowrap = enable
+        elif final == 'n' and arg(0, 0) == 6:
+            self.reply(f"\x1b[{self.y + 1};{self.x + 1}R")
+        elif final == 'c' and not private:
+            self.reply("\x1b[?1;2c")
+    
+    def reply(self, text):
+        if self.respond is not None:
+            self.respond(text.encode('ascii'))
+    
+    def erase_display(self, mode):
+        if mode == 0:
+            self.erase_line(0)
+            for y in range(self.y + 1, self.rows):
+                self.grid[y] = self.blank_row()
+                self.wrapped[y] = False
+        elif mode == 1:
+            self.erase_line(1)
+            for y in range(0, self.y):
+                self.grid[y] = self.blank_row()
+                self.wrapped[y] = False
+        else:
+            for y in range(self.rows):
+                self.grid[y] = self.blank_row()
+                self.wrapped[y] = False
+            if mode == 3:
+                self.scrollback.clear()
+                self.continues_line = False
+    
+    def erase_line(self, mode):
+        row = self.grid[self.y]
+        if mode == 0:
+            row[self.x:] = [' '] * (self.cols - self.x)
+            self.wrapped[self.y] = False
+        elif mode == 1:
+            row[:self.x + 1] = [' '] * (self.x + 1)
+        else:
+            self.grid[self.y] = self.blank_row()
+            self.wrapped[self.y] = False
+    
+    def set_alternate_screen(self, enable):
+        if enable and self.saved_grid is None:
+            self.saved_grid = (self.grid, self.wrapped, self.x, self.y)
+            self.grid = [self.blank_row() for _ in range(self.rows)]
+            self.wrapped = [False] * self.rows
+        elif not enable and self.saved_grid is not None:
+            self.grid, self.wrapped, self.x, self.y = self.saved_grid
+            self.saved_grid = None
+        self.pending_wrap = False
+
+def claim_terminal():
+    """preexec_fn: new session with the PTY slave (stdin) as controlling terminal"""
+    os.setsid()
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+class MappedLines:
+    """Read-only lines of a file through mmap, indexed in the background
+    
+    build_index() runs on a background thread and appends line start offsets
+    to an array a chunk at a time, so lines near the top can be shown
+    straight away. A line is only decoded when it is asked for, and memory
+    stays at a few bytes per line whatever the file size.
+    """
+    
+    def __init__(self, path):
+        # Opening a FIFO would block, and a device never ends
+        if not stat.S_ISREG(os.stat(path).st_mode):
+            raise OSError(errno.EINVAL, "Not a regular file")
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # procfs and sysfs files report no size until read; hold what there is
+            self.map = self.file.read()
+            self.size = len(self.map)
+        self.starts = array('I' if self.size < 1 << 32 else 'Q', [0])
+        self.indexed = 0      # bytes scanned for newlines so far
+        self.complete = self.size == 0
+        self.closed = False
+        self.lock = threading.Lock()
+    
+    def build_index(self, progress=None):
+        dtype = np.dtype(self.starts.typecode)
+        while True:
+            with self.lock:
+                if self.closed or self.indexed >= self.size:
+                    break
+                start = self.indexed
+                end = min(start + INDEX_CHUNK, self.size)
+                chunk = np.frombuffer(self.map, dtype=np.uint8, count=end - start, offset=start)
+                newlines = np.flatnonzero(chunk == 10) + (start + 1)
+                del chunk  # release the export so the map can be closed
+                self.starts.frombytes(newlines.astype(dtype).tobytes())
+                self.indexed = end
+                # Scanned pages are clean file pages; drop them rather than keep the file resident
+                if isinstance(self.map, mmap.mmap):
+                    aligned = start - start % mmap.PAGESIZE
+                    self.map.madvise(mmap.MADV_DONTNEED, aligned, end - aligned)
+            if progress is not None:
+                progress()
+        self.complete = True
+    
+    def __len__(self):
+        count = len(self.starts) - 1
+        if self.complete and self.starts[count] < self.size:
+            count += 1  # last line has no newline
+        return count
+    
+    def span(self, index):
+        """Byte range of a line, without its \n or \r\n; saving copies the ending as it was"""
+        start = self.starts[index]
+        end = self.starts[index + 1] - 1 if index + 1 < len(self.starts) else self.size
+        if end > start and self.map[end - 1] == 13:
+            end -= 1
+        return start, end
+    
+    def __getitem__(self, index):
+        start, end = self.span(index)
+        return self.map[start:end].decode('utf-8', 'replace')
+    
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if isinstance(self.map, mmap.mmap):
+                self.map.close()
+            self.file.close()
+
+class LineOverlay:
+    """Edits on top of MappedLines: changed lines in a dict, new lines in a list
+    
+    Saving copies the untouched byte ranges of the original file in
+    chunks and only encodes the lines that were changed.
+    """
+    
+    def __init__(self, base):
+        self.base = base
+        self.changed = {}
+        self.added = []
+    
+    @property
+    def complete(self):
+        return self.base.complete
+    
+    def __len__(self):
+        return len(self.base) + len(self.added)
+    
+    def __getitem__(self, index):
+        known = len(self.base)
+        if index >= known:
+            return self.added[index - known]
+        if index in self.changed:
+            return self.changed[index]
+        return self.base[index]
+    
+    def __setitem__(self, index, text):
+        known = len(self.base)
+        if index >= known:
+            self.added[index - known] = text
+        elif text == self.base[index]:
+            self.changed.pop(index, None)
+        else:
+            self.changed[index] = text
+    
+    def append(self, text):
+        self.added.append(text)
+    
+    def copy_range(self, f, start, end):
+        while start < end:
+            stop = min(start + INDEX_CHUNK, end)
+            f.write(self.base.map[start:stop])
+            start = stop
+    
+    def write_to(self, f):
+        """Stream the edited file to a binary file object"""
+        pos = 0
+        for index in sorted(self.changed):
+            start, end = self.base.span(index)
+            self.copy_range(f, pos, start)
+            f.write(self.changed[index].encode('utf-8'))
+            pos = end
+        self.copy_range(f, pos, self.base.size)
+        
+        ends_with_newline = self.base.size == 0 or self.base.map[self.base.size - 1] == 10
+        for text in self.added:
+            if not ends_with_newline:
+                f.write(b'\n')
+            f.write(text.encode('utf-8'))
+            ends_with_newline = False
+
+class Completer:
+    """Completes command names from PATH and paths from cached directory listings
+    
+    Each listing is a sorted name list stamped with the directory's mtime,
+    so a lookup is one stat and a bisect even in /usr/bin. The PATH index
+    needs a stat per file for the executable bit and is rebuilt on the
+    worker whenever one of the PATH directories changes.
+    """
+    
+    BUILTINS = ('cd', 'clear', 'exit', 'less', 'nano', 'pwd')
+    
+    def __init__(self, worker, home):
+        self.worker = worker
+        self.home = home
+        self.listings = {}          # directory -> (mtime, sorted names, directory names)
+        self.commands = sorted(self.BUILTINS)
+        self.commands_stamp = None
+    
+    def path_stamp(self):
+        stamp = []
+        for directory in os.environ.get('PATH', '').split(':'):
+            try:
+                stamp.append((directory, os.stat(directory).st_mtime_ns))
+            except OSError:
+                pass
+        return tuple(stamp)
+    
+    def refresh_commands(self):
+        stamp = self.path_stamp()
+        if stamp != self.commands_stamp:
+            self.worker.submit('path-index', lambda: self.scan_commands(stamp), self.on_commands)
+    
+    def scan_commands(self, stamp):
+        names = set(self.BUILTINS)
+        for directory, _ in stamp:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file() and os.access(entry.path, os.X_OK):
+                            names.add(entry.name)
+            except OSError:
+                pass
+        return stamp, sorted(names)
+    
+    def on_commands(self, result):
+        if result is not None:
+            self.commands_stamp, self.commands = result
+    
+    def scan_directory(self, directory, mtime):
+        names = []
+        dirs = set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                names.append(entry.name)
+                if entry.is_dir():
+                    dirs.add(entry.name)
+        names.sort()
+        return directory, (mtime, names, dirs)
+    
+    def store_listing(self, result):
+        if result is None:
+            return
+        directory, listing = result
+        self.listings.pop(directory, None)
+        self.listings[directory] = listing
+        while len(self.listings) > LISTING_CACHE:
+            del self.listings[next(iter(self.listings))]
+    
+    def prefetch(self, directory):
+        """Refresh a directory's listing on the worker if it is missing or stale"""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return
+        cached = self.listings.get(directory)
+        if cached is None or cached[0] != mtime:
+            self.worker.submit(('listing', directory), lambda: self.scan_directory(directory, mtime), self.store_listing)
+    
+    def listing(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+        cached = self.listings.get(directory)
+        if cached is None or cached[0] != mtime:
+            # Not prefetched: a bare scandir without stats is still quick
+            try:
+                self.store_listing(self.scan_directory(directory, mtime))
+            except OSError:
+                return None
+            cached = self.listings[directory]
+        return cached
+    
+    def prefixed(self, names, prefix):
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix + '\U0010ffff', start)
+        return names[start:end]
+    
+    def complete(self, word, command, cwd):
+        """Replacements for word, each with whether it names a directory"""
+        if command and '/' not in word:
+            if not word:
+                return []
+            self.refresh_commands()
+            return [(name, False) for name in self.prefixed(self.commands, word)]
+        
+        typed_head, prefix = word[:word.rfind('/') + 1], word[word.rfind('/') + 1:]
+        head = self.home + typed_head[1:] if typed_head.startswith('~/') else typed_head
+        listing = self.listing(os.path.join(cwd, head) if head else cwd)
+        if listing is None:
+            return []
+        _, names, dirs = listing
+        return [(typed_head + name, name in dirs) for name in self.prefixed(names, prefix)
+                if prefix.startswith('.') or not name.startswith('.')]
+
+class TextBuffer:
+    """nano's text: a list of lines, with the line being edited held in a gap buffer
+    
+    The edited line is split at the cursor into the text before the gap
+    and the reversed text after it, so typing and backspace are O(1)
+    amortized. Moving to another line folds the gap back into a plain
+    string. Saving streams line by line instead of joining the whole file.
+    """
+    
+    def __init__(self, lines=None):
+        self.lines = lines if lines is not None else [""]
+        self.row = 0
+        self.before = []
+        self.after = []     # reversed: after[-1] is the character right of the cursor
+        self.load(0, 0)
+    
+    def __len__(self):
+        return len(self.lines)
+    
+    @property
+    def cursor(self):
+        return len(self.before)
+    
+    def line(self, index):
+        if index == self.row and self.loaded:
+            return ''.join(self.before) + ''.join(reversed(self.after))
+        return self.lines[index]
+    
+    def load(self, row, col):
+        # A row past the end of a half-indexed file is not known yet, so it must not be committed
+        self.loaded = row < len(self.lines) or self.ready()
+        text = self.lines[row] if row < len(self.lines) else ""
+        col = min(col, len(text))
+        self.row = row
+        self.before = list(text[:col])
+        self.after = list(reversed(text[col:]))
+    
+    def ready(self):
+        """False while a mapped file's line index is still being built"""
+        return getattr(self.lines, 'complete', True)
+    
+    def commit(self):
+        """Fold the gap buffer back into the line list"""
+        if self.loaded and self.row < len(self.lines):
+            self.lines[self.row] = self.line(self.row)
+    
+    def focus(self, row, col):
+        """Move the gap to row/col, adding empty lines past the end"""
+        if row != self.row:
+            if row >= len(self.lines) and not self.ready():
+                return  # where the file ends isn't known yet
+            self.commit()
+            while len(self.lines) <= row:
+                self.lines.append("")
+            self.load(row, col)
+        elif not self.loaded:
+            self.load(row, col)
+        else:
+            self.move(col - self.cursor)
+    
+    def move(self, step):
+        while step < 0 and self.before:
+            self.after.append(self.before.pop())
+            step += 1
+        while step > 0 and self.after:
+            self.before.append(self.after.pop())
+            step -= 1
+    
+    def insert(self, text):
+        self.before.extend(text)
+    
+    def backspace(self):
+        if self.before:
+            self.before.pop()
+            return True
+        return False
+    
+    def clear_line(self):
+        self.before = []
+        self.after = []
+    
+    def has_content(self):
+        return any(self.line(i).strip() for i in range(len(self)))
+    
+    def write_to(self, f):
+        for i in range(len(self)):
+            if i:
+                f.write('\n')
+            f.write(self.line(i))
+
+class CommandHistory:
+    """Command history shared by all tabs, kept in an append-only file
+    
+    The file is read the first time history is needed. Running a command
+    again moves it to the newest end instead of storing it twice; only
+    HISTORY_LIMIT distinct commands are kept, and the file is rewritten
+    compacted once it has grown to twice that. A sorted list of the
+    commands turns a prefix search into two bisects. Until compaction the
+    file keeps every run, repeats included, which is what runs() returns
+    for a frequency model.
+    """
+    
+    def __init__(self, path, limit=HISTORY_LIMIT):
+        self.path = path
+        self.limit = limit
+        self.order = None       # command -> sequence number, oldest first
+        self.sorted = []
+        self.sequence = 0
+        self.file_lines = 0
+        self.log = []           # every run in the file, oldest first
+    
+    def load(self):
+        if self.order is not None:
+            return
+        self.order = {}
+        try:
+            with open(self.path, 'r', errors='replace') as f:
+                for line in f:
+                    self.file_lines += 1
+                    self.log.append(line.rstrip('\n'))
+                    self.touch(self.log[-1])
+        except OSError:
+            pass
+        while len(self.order) > self.limit:
+            del self.order[next(iter(self.order))]
+        self.sorted = sorted(self.order)
+    
+    def touch(self, cmd):
+        """Make cmd the newest entry; True if it wasn't there before"""
+        new = self.order.pop(cmd, None) is None
+        self.sequence += 1
+        self.order[cmd] = self.sequence
+        return new
+    
+    def add(self, cmd):
+        self.load()
+        if self.touch(cmd):
+            bisect.insort(self.sorted, cmd)
+            if len(self.order) > self.limit:
+                oldest = next(iter(self.order))
+                del self.order[oldest]
+                del self.sorted[bisect.bisect_left(self.sorted, oldest)]
+        
+        try:
+            if self.file_lines >= 2 * self.limit:
+                self.compact()
+            else:
+                with open(self.path, 'a') as f:
+                    f.write(cmd + '\n')
+                self.file_lines += 1
+                self.log.append(cmd)
+        except OSError:
+            pass
+    
+    def runs(self):
+        """Commands as they were run, oldest first, a repeated one once per run"""
+        self.load()
+        return self.log
+    
+    def compact(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            for cmd in self.order:
+                f.write(cmd + '\n')
+        os.replace(temp_path, self.path)
+        self.file_lines = len(self.order)
+        self.log = list(self.order)
+    
+    def matches(self, prefix):
+        """Commands starting with prefix (other than prefix itself), newest first"""
+        self.load()
+        start = bisect.bisect_left(self.sorted, prefix)
+        end = bisect.bisect_left(self.sorted, prefix + '\U0010ffff', start)
+        hits = [cmd for cmd in self.sorted[start:end] if cmd != prefix]
+        hits.sort(key=self.order.__getitem__, reverse=True)
+        return hits
+
+class CommandPredictor:
+    """Suggests the next word of a command from an n-gram model of past commands
+    
+    Each word is counted under the two words before it, the one word
+    before it and on its own (the start of a command counts as an empty
+    word). Newer commands weigh more: every observation is worth RECENCY
+    times the previous one, and all weights are scaled down together before
+    they overflow. A query reads the longest context first and backs off
+    to shorter ones, so it only touches a few small dicts.
+    """
+    
+    RECENCY = 1.05
+    
+    def __init__(self):
+        self.counts = {}    # context tuple -> {word: weight}
+        self.weight = 1.0
+    
+    def observe(self, cmd):
+        padded = ['', ''] + cmd.split()
+        for i in range(2, len(padded)):
+            word = padded[i]
+            for context in ((padded[i-2], padded[i-1]), (padded[i-1],), ()):
+                table = self.counts.setdefault(context, {})
+                table[word] = table.get(word, 0.0) + self.weight
+        
+        self.weight *= self.RECENCY
+        if self.weight > 1e50:
+            for table in self.counts.values():
+                for word in table:
+                    table[word] /= self.weight
+            self.weight = 1.0
+    
+    def suggest(self, text, limit=SUGGESTIONS):
+        """Likely next words for text; a word being typed narrows them to its completions"""
+        words = text.split()
+        partial = words.pop() if words and not text[-1].isspace() else ''
+        padded = ['', ''] + words
+        
+        # Any word at all is a fallback for arguments, never for the command itself
+        contexts = [(padded[-2], padded[-1]), (padded[-1],)] + ([()] if words else [])
+        found = []
+        for context in contexts:
+            table = self.counts.get(context)
+            if not table:
+                continue
+            if partial:
+                items = [(weight, word) for word, weight in table.items()
+                         if word.startswith(partial) and word != partial]
+            else:
+                items = [(weight, word) for word, weight in table.items()]
+            for _, word in heapq.nlargest(limit, items):
+                if word not in found:
+                    found.append(word)
+            if len(found) >= limit:
+                break
+        return found[:limit]
+
 class Terminal:
     def __init__(self):
         self.command_input = ""
         self.cursor_pos = 0
-        self.output_lines = []
-        self.command_history = []
+        self.output_lines = Scrollback()
+        self.screen = TerminalScreen(self.output_lines, respond=self.write_to_pty)
         self.history_index = -1
+        self.history_prefix = ""     # what was typed before walking the history
+        self.history_matches = []
+        self.completion = None       # (input after completing, word start, candidates, index) for cycling
+        self.suggestion_key = None
+        self.suggestion_list = []    # (label, whole command?) shown above the keyboard
         self.keyboard_visible = False
         self.kb_page = 0
         self.kb_row = 0
         self.kb_col = 0
         self.scroll_offset = 0
         self.pty_master = None
+        self.pty_file = None
+        self.decoder = None
         self.pty_slave = None
         self.process = None
-        self.read_thread = None
+        self.pidfd = None
+        self.command_running = False
+        self.interrupt_time = 0      # last ^C sent; a second KEY2 soon after kills
+        self.is_shell = False        # process is the persistent bash, not one command
+        self.shell_ready = False
+        self.unseen_output = False   # output arrived while another tab was shown
         self.caps_lock = False
         
         # Nano editor state
         self.in_nano = False
         self.nano_filename = ""
-        self.nano_lines = []
-        self.nano_current_line = 0
-        self.nano_cursor = 0
+        self.nano_buffer = TextBuffer()
         self.nano_modified = False
         self.nano_asking_exit = False
         
+        # Pager (less) state
+        self.pager = None          # MappedLines being viewed
+        self.pager_filename = ""
+        self.pager_top = 0
+        
         try:
             pi_home = pwd.getpwnam('pi').pw_dir
             self.working_dir = pi_home
         except:
             self.working_dir = os.path.expanduser("~")
+    
+    def write_to_pty(self, data):
+        """Answer terminal queries from the running program"""
+        if self.pty_master is not None:
+            try:
+                os.write(self.pty_master, data)
+            except OSError:
+                pass
 
 class PocketTerminal:
     def __init__(self):
@@ -62,6 +2269,14 @@ class PocketTerminal:
         self.LCD = LCD_1in44.LCD()
         self.LCD.LCD_Init(LCD_1in44.SCAN_DIR_DFT)
         self.LCD.LCD_Clear()
+        self.display = DirtyRectDisplay(self.LCD)
+        self.frame = None
+        self.glyphs = GlyphAtlas(ImageDraw.Draw(Image.new("RGB", (1, 1))).getfont())
+        self.rgb_cache = {}
+        
+        # PTY reads land here; decoded text is the only per-chunk allocation
+        self.pty_buffer = bytearray(16384)
+        self.pty_view = memoryview(self.pty_buffer)
         
         # Setup GPIO
         GPIO.setwarnings(False)
@@ -82,10 +2297,15 @@ class PocketTerminal:
             os.chdir(pi_home)
         except:
             os.chdir(os.path.expanduser("~"))
+        home = os.getcwd()
+        self.history = CommandHistory(os.path.join(home, HISTORY_FILE))
+        self.predictor = None        # built from history when the keyboard first needs it
         
         # State
         self.current_screen = "menu"
-        self.terminal = Terminal()
+        # Terminal sessions (tabs); self.terminal is the one on screen
+        self.sessions = [Terminal()]
+        self.terminal = self.sessions[0]
         self.menu_index = 0
         
         # Settings
@@ -139,12 +2359,19 @@ class PocketTerminal:
         self.wifi_menu_section = 0
         self.wifi_password_input = ""
         self.entering_wifi_password = False
+        self.wifi_join_ssid = None
+        self.wifi_push_timers = {}
+        self.wlan_link_up = {wlan: self.link_up(wlan) for wlan in self.available_wlans}
+        
+        # Cached results, stamped with when they arrived (time.monotonic)
+        self.wlan_checked = {}
+        self.wifi_scanned = {}
+        self.wifi_action = {}   # "Connecting..." etc. while an nmcli action runs
         
         for wlan in self.available_wlans:
             self.wlan_enabled[wlan] = False
             self.wifi_connected[wlan] = None
             self.wifi_networks[wlan] = []
-        self.check_all_wlan_status()
         
         # Settings menu
         self.settings_menu_index = 0
@@ -152,9 +2379,11 @@ class PocketTerminal:
         self.theme_options = ["dark", "light", "orange"]
         self.theme_select_index = 0
         self.in_brightness_adjust = False
+        self.persistent_shell = False   # one bash per tab instead of a fork per command
         
         # System info
-        self.system_info = {}
+        self.system_info = SystemInfo()
+        self.about_shown = {}
         
         # Keyboard layouts
         self.keyboard_layouts = [
@@ -172,171 +2401,299 @@ class PocketTerminal:
             ]
         ]
         
-        self.keyboard_bottom_row = ['<-','->','SPC','CAPS','BSP','CLR','MORE']
+        self.keyboard_bottom_row = ['<-','->','TAB','SPC','CAPS','BSP','CLR','MORE']
+        self.keyboard_layers = {}
         
-        # Button tracking
-        self.button_prev = {}
-        self.button_time = {}
-        for pin in input_pins:
-            self.button_prev[pin] = GPIO.HIGH
-            self.button_time[pin] = 0
+        # Event loop and button events
+        self.loop = EventLoop()
+        self.buttons = ButtonInput(input_pins)
+        self.loop.add_reader(self.buttons.fileno(), self.on_button_events)
+        self.worker = Worker(self.loop)
+        self.completer = Completer(self.worker, home)
+        self.wifi = self.make_wifi_backend()
+        self.metrics = MetricsSampler(self.loop)
+        self.metrics.listeners.append(self.on_metrics_sample)
+        self.metrics.start()
+        self.check_all_wlan_status()
+        try:
+            self.links = LinkMonitor()
+            self.loop.add_reader(self.links.fileno(), self.on_link_events)
+        except OSError:
+            self.links = None
+        self.current_event = None
         
         # KEY1 for shutdown/reboot
-        self.key1_press_start = 0
         self.shutdown_threshold = 5.0
         self.reboot_threshold = 0.5
         
+        # Raw edges become typed events; KEY1 is the chord modifier
+        self.inputs = InputEvents(self.loop, self.handle_input,
+                                  repeat_pins=[KEY_UP_PIN, KEY_DOWN_PIN, KEY_LEFT_PIN, KEY_RIGHT_PIN],
+                                  modifiers=[KEY1_PIN],
+                                  long_press={KEY1_PIN: self.shutdown_threshold})
+        
         self.running = True
-        self.last_draw_time = 0
         self.needs_redraw = False
+        
+        # Frame pacing: redraw requests are merged into at most one frame per
+        # interval, and the interval stretches while frames come back to back
+        self.min_frame_interval = 1 / 30
+        self.target_frame_interval = 1 / 15
+        self.max_frame_interval = 0.25
+        self.frame_interval = self.min_frame_interval
+        self.frame_timer = None
+        self.last_frame_time = 0
+        
+        # Timers
+        self.blink_timer = None
+        self.wifi_refresh_timer = None
+        self.about_timer = None
+        self.wifi_tick_interval = 5.0
+        self.wifi_refresh_interval = 15.0
+        self.wifi_scan_interval = 60.0
     
     def get_color(self, key):
         return self.themes[self.theme][key]
     
-    def button_pressed(self, pin, debounce=0.15):
-        current = GPIO.input(pin)
-        if current == GPIO.LOW and self.button_prev[pin] == GPIO.HIGH:
-            if time.time() - self.button_time[pin] >= debounce:
-                self.button_prev[pin] = current
-                self.button_time[pin] = time.time()
-                return True
-        self.button_prev[pin] = current
-        return False
+    def rgb(self, color):
+        if color not in self.rgb_cache:
+            self.rgb_cache[color] = ImageColor.getrgb(color)
+        return self.rgb_cache[color]
+    
+    def button_pressed(self, pin):
+        """True if the event being handled is a press of pin, or a repeat while it is held"""
+        event = self.current_event
+        return event is not None and event.pin == pin
+    
+    def held_step(self):
+        """How far a held button moves things: 1 for a press, more as a repeat speeds up"""
+        return self.current_event.step
+    
+    def request_redraw(self):
+        """Ask for a new frame; requests before it is drawn share it"""
+        self.needs_redraw = True
+        if self.frame_timer is None:
+            delay = self.last_frame_time + self.frame_interval - time.monotonic()
+            self.frame_timer = self.loop.call_later(max(0, delay), self.render_frame)
+    
+    def render_frame(self):
+        self.frame_timer = None
+        if not self.needs_redraw:
+            return
+        
+        start = time.monotonic()
+        busy = start - self.last_frame_time < self.frame_interval * 2
+        self.draw_screen()
+        end = time.monotonic()
+        
+        if busy:
+            # Streaming output: keep drawing to about a third of the time so
+            # PTY reads and buttons still get the loop
+            self.frame_interval = min(self.max_frame_interval,
+                                      max(self.target_frame_interval, (end - start) * 3))
+        else:
+            self.frame_interval = self.min_frame_interval
+        self.last_frame_time = end
+    
+    def is_wlan(self, name):
+        return name.startswith('wlan') or os.path.isdir(f'/sys/class/net/{name}/wireless')
     
     def detect_wlan_interfaces(self):
         try:
-            result = subprocess.run(['ls', '/sys/class/net/'], 
-                                  capture_output=True, text=True, timeout=2)
-            interfaces = result.stdout.strip().split('\n')
-            wlans = sorted([iface for iface in interfaces if iface.startswith('wlan')])
+            with os.scandir('/sys/class/net') as entries:
+                wlans = sorted(entry.name for entry in entries if self.is_wlan(entry.name))
             return wlans if wlans else ['wlan0']
-        except:
+        except OSError:
             return ['wlan0']
     
+    def link_up(self, wlan):
+        """operstate up with carrier, straight from sysfs"""
+        try:
+            with open(f'/sys/class/net/{wlan}/operstate') as f:
+                if f.read().strip() != 'up':
+                    return False
+            with open(f'/sys/class/net/{wlan}/carrier') as f:
+                return f.read().strip() == '1'
+        except OSError:
+            return False
+    
+    def set_wlan_list(self, wlans):
+        """Adopt a new interface list, keeping the selected interface when it is still there"""
+        current = self.get_current_wlan()
+        self.available_wlans = wlans
+        for wlan in wlans:
+            if wlan not in self.wlan_enabled:
+                self.wlan_enabled[wlan] = False
+                self.wifi_connected[wlan] = None
+                self.wifi_networks[wlan] = []
+                self.check_wlan_status(wlan)
+        if current in wlans:
+            self.current_wlan_idx = wlans.index(current)
+        else:
+            self.current_wlan_idx = 0
+            self.wifi_menu_section = 0
+    
+    def on_link_events(self):
+        events = self.links.read()
+        if events is None:
+            # Missed messages: re-read the whole list
+            self.set_wlan_list(self.detect_wlan_interfaces())
+            self.check_all_wlan_status()
+            self.request_redraw()
+            return
+        
+        wlans = list(self.available_wlans)
+        changed = set()
+        for name, present, up in events:
+            if present and self.is_wlan(name):
+                if name not in wlans:
+                    wlans.append(name)
+                if self.wlan_link_up.get(name) != up:
+                    self.wlan_link_up[name] = up
+                    changed.add(name)
+            elif not present and name in wlans:
+                wlans.remove(name)
+                self.wlan_link_up.pop(name, None)
+                self.wlan_enabled[name] = False
+                self.wifi_connected[name] = None
+        
+        if not changed and wlans == self.available_wlans:
+            return
+        if wlans != self.available_wlans:
+            self.set_wlan_list(sorted(wlans) or ['wlan0'])
+        for wlan in changed:
+            if not self.wlan_link_up[wlan]:
+                self.wifi_connected[wlan] = None
+            # The SSID and radio state still come from the backend
+            self.check_wlan_status(wlan)
+        self.request_redraw()
+    
     def get_current_wlan(self):
         if self.current_wlan_idx < len(self.available_wlans):
             return self.available_wlans[self.current_wlan_idx]
         return self.available_wlans[0] if self.available_wlans else 'wlan0'
     
+    def make_wifi_backend(self):
+        """NetworkManager over D-Bus when jeepney and NetworkManager are there, nmcli otherwise"""
+        if open_dbus_connection is not None:
+            def notify(kind, wlan):
+                self.loop.call_soon_threadsafe(lambda: self.on_wifi_pushed(kind, wlan))
+            try:
+                return NetworkManagerWifi(notify)
+            except Exception:
+                pass
+        return NmcliWifi()
+    
     def check_all_wlan_status(self):
+        """Probe every interface at once on the worker; results land in the cache"""
         for wlan in self.available_wlans:
-            try:
-                result = subprocess.run(['nmcli', 'device', 'show', wlan],
-                                      capture_output=True, text=True, timeout=2)
-                
-                if 'connected' in result.stdout.lower():
-                    self.wlan_enabled[wlan] = True
-                    conn_result = subprocess.run(['nmcli', '-t', '-f', 'ACTIVE,SSID', 
-                                                 'device', 'wifi', 'list', 'ifname', wlan],
-                                                capture_output=True, text=True, timeout=2)
-                    for line in conn_result.stdout.strip().split('\n'):
-                        if line.startswith('yes:'):
-                            self.wifi_connected[wlan] = line.split(':', 1)[1]
-                            break
-                    else:
-                        self.wifi_connected[wlan] = None
-                else:
-                    self.wlan_enabled[wlan] = False
-                    self.wifi_connected[wlan] = None
-            except:
-                self.wlan_enabled[wlan] = False
-                self.wifi_connected[wlan] = None
+            self.check_wlan_status(wlan)
     
-    def toggle_wlan(self, wlan):
-        try:
-            if self.wlan_enabled[wlan]:
-                subprocess.run(['sudo', 'nmcli', 'radio', 'wifi', 'off', 'ifname', wlan], timeout=5)
-                self.wlan_enabled[wlan] = False
-                self.wifi_connected[wlan] = None
-            else:
-                subprocess.run(['sudo', 'nmcli', 'radio', 'wifi', 'on', 'ifname', wlan], timeout=5)
-                self.wlan_enabled[wlan] = True
-        except:
-            pass
+    def check_wlan_status(self, wlan):
+        self.worker.submit(('status', wlan), lambda: self.wifi.status(wlan),
+                           lambda status: self.on_wlan_status(wlan, status))
     
-    def scan_wifi(self, wlan):
-        try:
-            subprocess.run(['sudo', 'nmcli', 'device', 'wifi', 'rescan', 'ifname', wlan],
-                          capture_output=True, text=True, timeout=5)
-            time.sleep(1)
-            
-            result = subprocess.run(['nmcli', '-t', '-f', 'SSID,SIGNAL', 'device', 'wifi', 
-                                   'list', 'ifname', wlan],
-                                  capture_output=True, text=True, timeout=5)
-            networks = []
-            for line in result.stdout.strip().split('\n'):
-                if line and ':' in line:
-                    parts = line.split(':')
-                    if len(parts) >= 2 and parts[0]:
-                        ssid = parts[0]
-                        signal = parts[1] if len(parts) > 1 else '0'
-                        if ssid != self.wifi_connected.get(wlan):
-                            networks.append({'ssid': ssid, 'signal': signal})
-            
-            seen = {}
-            for net in networks:
-                if net['ssid'] not in seen or int(net['signal']) > int(seen[net['ssid']]['signal']):
-                    seen[net['ssid']] = net
-            
-            self.wifi_networks[wlan] = list(seen.values())
-            self.wifi_networks[wlan].sort(key=lambda x: int(x['signal']), reverse=True)
-        except:
+    def on_wifi_pushed(self, kind, wlan):
+        """Backend signal: refresh that part of the cache once per burst"""
+        key = (kind, wlan)
+        if key in self.wifi_push_timers:
+            return
+        
+        def refresh():
+            del self.wifi_push_timers[key]
+            for name in ([wlan] if wlan else self.available_wlans):
+                if name not in self.available_wlans:
+                    continue
+                if kind == 'networks':
+                    self.worker.submit(('networks', name), lambda name=name: self.wifi.access_points(name),
+                                       lambda networks, name=name: self.on_wifi_scan(name, networks))
+                else:
+                    self.check_wlan_status(name)
+        
+        self.wifi_push_timers[key] = self.loop.call_later(0.3, refresh)
+    
+    def on_wlan_status(self, wlan, status):
+        if status is None:
+            return
+        self.wlan_enabled[wlan], self.wifi_connected[wlan] = status
+        self.wlan_checked[wlan] = time.monotonic()
+        if not self.wlan_enabled[wlan]:
             self.wifi_networks[wlan] = []
+        elif (self.current_screen == "wifi" and wlan == self.get_current_wlan()
+                and time.monotonic() - self.wifi_scanned.get(wlan, 0) >= self.wifi_scan_interval):
+            self.scan_wifi(wlan)
+        self.request_redraw()
     
-    def connect_wifi(self, wlan, ssid, password):
-        try:
-            subprocess.run(['sudo', 'nmcli', 'device', 'wifi', 'connect', ssid, 
-                          'password', password, 'ifname', wlan], timeout=15, check=True)
-            self.wifi_connected[wlan] = ssid
-            self.wifi_networks[wlan] = [net for net in self.wifi_networks[wlan] if net['ssid'] != ssid]
-        except:
-            pass
+    def scan_wifi(self, wlan):
+        self.worker.submit(('scan', wlan), lambda: self.wifi.scan(wlan),
+                           lambda networks: self.on_wifi_scan(wlan, networks))
+        self.request_redraw()
     
-    def disconnect_wifi(self, wlan):
-        try:
-            subprocess.run(['sudo', 'nmcli', 'device', 'disconnect', wlan], timeout=5)
-            if self.wifi_connected[wlan]:
-                self.scan_wifi(wlan)
-            self.wifi_connected[wlan] = None
-        except:
-            pass
+    def on_wifi_scan(self, wlan, networks):
+        connected = self.wifi_connected.get(wlan)
+        self.wifi_networks[wlan] = [net for net in networks or [] if net['ssid'] != connected]
+        self.wifi_scanned[wlan] = time.monotonic()
+        if wlan == self.get_current_wlan():
+            self.wifi_menu_section = min(self.wifi_menu_section, 2 + len(self.wifi_networks[wlan]))
+        self.request_redraw()
     
-    def get_system_info(self):
-        info = {}
-        try:
-            with open('/proc/device-tree/model', 'r') as f:
-                info['model'] = f.read().strip().replace('\x00', '')
-        except:
-            info['model'] = 'Unknown'
-        
-        try:
-            result = subprocess.run(['vcgencmd', 'measure_temp'], 
-                                  capture_output=True, text=True, timeout=1)
-            info['temp'] = result.stdout.strip()
-        except:
-            info['temp'] = 'N/A'
+    def run_wifi_action(self, wlan, label, action):
+        """Run a backend action then re-probe the interface, without blocking the UI"""
+        def job():
+            ok = action()
+            return ok, self.wifi.status(wlan)
         
-        try:
-            result = subprocess.run(['uname', '-r'], 
-                                  capture_output=True, text=True, timeout=1)
-            info['firmware'] = result.stdout.strip()
-        except:
-            info['firmware'] = 'N/A'
+        def done(result):
+            self.wifi_action.pop(wlan, None)
+            if result is None:
+                return
+            ok, status = result
+            if ok is False:
+                self.show_wifi_message(wlan, "Failed")
+            self.wifi_scanned.pop(wlan, None)   # force a fresh scan
+            self.on_wlan_status(wlan, status)
         
-        try:
-            result = subprocess.run(['uptime', '-p'], 
-                                  capture_output=True, text=True, timeout=1)
-            info['uptime'] = result.stdout.strip()
-        except:
-            info['uptime'] = 'N/A'
+        if self.worker.submit(('action', wlan), job, done):
+            self.wifi_action[wlan] = label
+            self.request_redraw()
+    
+    def show_wifi_message(self, wlan, text, duration=3.0):
+        self.wifi_action[wlan] = text
         
-        self.system_info = info
+        def clear():
+            if self.wifi_action.get(wlan) == text:
+                del self.wifi_action[wlan]
+                self.request_redraw()
+        self.loop.call_later(duration, clear)
+    
+    def toggle_wlan(self, wlan):
+        """Flip the radio for all interfaces; the others catch up on their next status"""
+        on = not self.wlan_enabled[wlan]
+        self.run_wifi_action(wlan, "Turning on..." if on else "Turning off...",
+                             lambda: self.wifi.set_radio(on))
+    
+    def connect_wifi(self, wlan, ssid, password):
+        self.run_wifi_action(wlan, "Connecting...",
+                             lambda: self.wifi.connect(wlan, ssid, password))
+    
+    def disconnect_wifi(self, wlan):
+        self.run_wifi_action(wlan, "Disconnecting...", lambda: self.wifi.disconnect(wlan))
+    
+    def wifi_age(self, wlan):
+        """How old the network list is, for the screen"""
+        if self.worker.busy(('scan', wlan)):
+            return "scanning"
+        if wlan not in self.wifi_scanned:
+            return ""
+        age = int(time.monotonic() - self.wifi_scanned[wlan])
+        return f"{age}s ago" if age < 60 else f"{age // 60}m ago"
     
     # ==================== DRAWING ====================
     
     def draw_screen(self):
-        image = Image.new("RGB", (128, 128), self.get_color("bg"))
+        image = Image.new("RGB", (LCD_WIDTH, LCD_HEIGHT), self.get_color("bg"))
         draw = ImageDraw.Draw(image)
+        self.frame = image
         
         if self.current_screen == "menu":
             self.draw_main_menu(draw)
@@ -346,38 +2703,109 @@ class PocketTerminal:
             self.draw_wifi(draw)
         elif self.current_screen == "settings":
             self.draw_settings(draw)
+        elif self.current_screen == "monitor":
+            self.draw_monitor(draw)
         elif self.current_screen == "about":
             self.draw_about(draw)
         
-        self.LCD.LCD_ShowImage(image, 0, 0)
-        self.last_draw_time = time.time()
+        self.display.show(image)
         self.needs_redraw = False
+        self.schedule_screen_timers()
+    
+    def schedule_screen_timers(self):
+        """Arm the timers the visible screen needs; nothing runs while idle elsewhere"""
+        term = self.terminal
+        if self.current_screen == "terminal" and not term.in_nano and term.pager is None and not term.keyboard_visible:
+            if self.blink_timer is None:
+                # Cursor blink flips on every half-second boundary
+                now = time.time()
+                self.blink_timer = self.loop.call_later(0.5 - (now % 0.5), self.on_blink_timer)
+        
+        if self.current_screen == "wifi" and not self.entering_wifi_password:
+            if self.wifi_refresh_timer is None:
+                self.wifi_refresh_timer = self.loop.call_later(self.wifi_tick_interval, self.on_wifi_refresh_timer)
+        
+        if self.current_screen == "about" and self.about_timer is None:
+            self.about_timer = self.loop.call_later(1, self.on_about_timer)
+    
+    def on_blink_timer(self):
+        self.blink_timer = None
+        term = self.terminal
+        if self.current_screen == "terminal" and not term.in_nano and term.pager is None and not term.keyboard_visible:
+            self.request_redraw()
+    
+    def on_wifi_refresh_timer(self):
+        self.wifi_refresh_timer = None
+        if self.current_screen == "wifi" and not self.entering_wifi_password:
+            # Ticks keep the "updated" age current; stale caches refresh in the background
+            now = time.monotonic()
+            wlan = self.get_current_wlan()
+            if not self.wifi.pushes_updates and now - self.wlan_checked.get(wlan, 0) >= self.wifi_refresh_interval:
+                self.check_all_wlan_status()
+            elif self.wlan_enabled[wlan] and now - self.wifi_scanned.get(wlan, 0) >= self.wifi_scan_interval:
+                self.scan_wifi(wlan)
+            self.request_redraw()
+    
+    def on_metrics_sample(self):
+        if self.current_screen == "monitor":
+            self.request_redraw()
+    
+    def on_about_timer(self):
+        self.about_timer = None
+        if self.current_screen == "about":
+            # Only redraw when a value on screen actually changed
+            if self.system_info.snapshot() != self.about_shown:
+                self.request_redraw()
+            else:
+                self.schedule_screen_timers()
+    
+    def draw_text(self, draw, xy, text, fill, bg=None):
+        """Draw text from the glyph atlas, falling back to ImageDraw.text"""
+        fg = self.rgb(fill)
+        if bg is not None:
+            bg = self.rgb(bg)
+        if not self.glyphs.draw(self.frame, xy, text, fg, bg):
+            draw.text(xy, text, fill=fill)
     
     def draw_main_menu(self, draw):
         draw.rectangle([(0, 0), (127, 12)], fill=self.get_color("title_bg"))
-        draw.text((15, 2), "POCKET TERMINAL", fill=self.get_color("title_fg"))
+        self.draw_text(draw, (15, 2), "POCKET TERMINAL", fill=self.get_color("title_fg"))
         
-        menu_items = ["Terminal", "WiFi", "Settings", "About"]
-        y = 25
+        menu_items = ["Terminal", "WiFi", "Monitor", "Settings", "About"]
+        y = 18
         for i, item in enumerate(menu_items):
             if i == self.menu_index:
                 draw.rectangle([(5, y), (122, y+15)], fill=self.get_color("select_bg"))
-                draw.text((10, y+2), f"> {item}", fill=self.get_color("select_fg"))
+                self.draw_text(draw, (10, y+2), f"> {item}", fill=self.get_color("select_fg"))
             else:
-                draw.text((10, y+2), f"  {item}", fill=self.get_color("fg"))
-            y += 18
+                self.draw_text(draw, (10, y+2), f"  {item}", fill=self.get_color("fg"))
+            y += 17
         
-        draw.text((5, 112), "Up/Dn:Nav K3:Open", fill=self.get_color("prompt"))
+        self.draw_text(draw, (5, 112), "Up/Dn:Nav K3:Open", fill=self.get_color("prompt"))
     
     def draw_terminal(self, draw):
         term = self.terminal
         
         draw.rectangle([(0, 0), (127, 10)], fill=self.get_color("title_bg"))
-        draw.text((2, 1), "TERMINAL", fill=self.get_color("title_fg"))
+        self.draw_text(draw, (2, 1), "TERMINAL", fill=self.get_color("title_fg"))
+        
+        # Tab numbers, current one inverted, busy background tabs highlighted
+        if len(self.sessions) > 1:
+            x = 128 - 8 * len(self.sessions)
+            for i, session in enumerate(self.sessions):
+                if session is term:
+                    draw.rectangle([(x, 0), (x+6, 10)], fill=self.get_color("title_fg"))
+                    self.draw_text(draw, (x+1, 1), str(i+1), fill=self.get_color("title_bg"))
+                else:
+                    color = self.get_color("prompt") if session.unseen_output else self.get_color("title_fg")
+                    self.draw_text(draw, (x+1, 1), str(i+1), fill=color)
+                x += 8
         
         # Check if in nano mode
         if term.in_nano:
             self.draw_nano(draw, term)
+        elif term.pager is not None:
+            self.draw_pager(draw, term)
         elif term.keyboard_visible:
             self.draw_terminal_with_keyboard(draw, term)
         else:
@@ -387,119 +2815,80 @@ class PocketTerminal:
         # Nano header
         if term.nano_asking_exit:
             draw.rectangle([(0, 0), (127, 10)], fill="RED")
-            draw.text((2, 1), "Exit without save?", fill="WHITE")
+            self.draw_text(draw, (2, 1), "Exit without save?", fill="WHITE")
         else:
             draw.rectangle([(0, 0), (127, 10)], fill="GREEN")
             filename_display = term.nano_filename[:13] if len(term.nano_filename) <= 13 else "..." + term.nano_filename[-10:]
             mod_indicator = "*" if term.nano_modified else ""
-            draw.text((2, 1), f"nano {filename_display}{mod_indicator}", fill="BLACK")
+            self.draw_text(draw, (2, 1), f"nano {filename_display}{mod_indicator}", fill="BLACK")
         
         if term.nano_asking_exit:
             # Show exit dialog
-            draw.text((2, 20), "KEY3: Exit", fill="WHITE")
-            draw.text((2, 35), "KEY2: Cancel", fill="WHITE")
+            self.draw_text(draw, (2, 20), "KEY3: Exit", fill="WHITE")
+            self.draw_text(draw, (2, 35), "KEY2: Cancel", fill="WHITE")
         elif term.keyboard_visible:
             # Nano with keyboard
             y_pos = 12
-            current_line = term.nano_lines[term.nano_current_line] if term.nano_current_line < len(term.nano_lines) else ""
+            buffer = term.nano_buffer
+            current_line = buffer.line(buffer.row)
             display_text = current_line[:16].replace(' ', '_')
-            draw.text((2, y_pos), f"L{term.nano_current_line+1}:{display_text}", fill="WHITE")
+            self.draw_text(draw, (2, y_pos), f"L{buffer.row+1}:{display_text}", fill="WHITE")
             
             # Cursor
-            prompt_width = len(f"L{term.nano_current_line+1}:") * 6
-            cursor_x = prompt_width + 2 + (term.nano_cursor * 6)
+            prompt_width = len(f"L{buffer.row+1}:") * 6
+            cursor_x = prompt_width + 2 + (buffer.cursor * 6)
             draw.line([(cursor_x, y_pos), (cursor_x, y_pos+10)], fill="YELLOW", width=2)
             
             # Separator
             draw.line([(0, 24), (127, 24)], fill="CYAN", width=1)
             
             # Draw keyboard
-            current_layout = self.keyboard_layouts[term.kb_page]
-            
-            y_kb = 26
-            for r, row in enumerate(current_layout):
-                x_kb = 2
-                for c, key in enumerate(row):
-                    key_width = 11
-                    
-                    display_key = key
-                    if term.caps_lock and key.isalpha():
-                        display_key = key.upper()
-                    
-                    if r == term.kb_row and c == term.kb_col:
-                        draw.rectangle([(x_kb, y_kb), (x_kb+key_width, y_kb+13)], 
-                                     fill=self.get_color("select_bg"))
-                        draw.text((x_kb+3, y_kb+2), display_key, fill=self.get_color("select_fg"))
-                    else:
-                        draw.rectangle([(x_kb, y_kb), (x_kb+key_width, y_kb+13)], 
-                                     outline=self.get_color("fg"))
-                        draw.text((x_kb+3, y_kb+2), display_key, fill=self.get_color("fg"))
-                    
-                    x_kb += key_width + 1
-                y_kb += 14
-            
-            # Bottom row
-            y_bottom = 82
-            x_kb = 0
-            for i, key in enumerate(self.keyboard_bottom_row):
-                if key in ['SPC', 'CAPS', 'BSP', 'CLR', 'MORE']:
-                    key_width = 17
-                else:
-                    key_width = 14
-                
-                if key == 'CAPS' and term.caps_lock:
-                    draw.rectangle([(x_kb, y_bottom), (x_kb+key_width, y_bottom+14)], 
-                                 fill="GREEN")
-                    draw.text((x_kb+2, y_bottom+2), key, fill="BLACK")
-                elif term.kb_row == 4 and term.kb_col == i:
-                    draw.rectangle([(x_kb, y_bottom), (x_kb+key_width, y_bottom+14)], 
-                                 fill=self.get_color("select_bg"))
-                    draw.text((x_kb+2, y_bottom+2), key, fill=self.get_color("select_fg"))
-                else:
-                    draw.rectangle([(x_kb, y_bottom), (x_kb+key_width, y_bottom+14)], 
-                                 outline=self.get_color("fg"))
-                    draw.text((x_kb+2, y_bottom+2), key, fill=self.get_color("fg"))
-                
-                x_kb += key_width + 1
+            self.draw_keyboard(draw, term, 26, 13, 14, 82, 14)
         else:
             # Nano without keyboard - show file content
             y_pos = 12
             # Show 8 lines starting from current line
-            start_line = max(0, term.nano_current_line - 3)
-            end_line = min(len(term.nano_lines), start_line + 8)
+            buffer = term.nano_buffer
+            start_line = max(0, buffer.row - 3)
+            end_line = min(len(buffer), start_line + 8)
             
             for i in range(start_line, end_line):
-                line_text = term.nano_lines[i] if i < len(term.nano_lines) else ""
-                display_text = line_text[:21]
+                display_text = buffer.line(i)[:21]
                 
                 # Highlight current line
-                if i == term.nano_current_line:
+                if i == buffer.row:
                     draw.rectangle([(0, y_pos), (127, y_pos+12)], fill="DARKGRAY")
-                    draw.text((2, y_pos), display_text, fill="YELLOW")
+                    self.draw_text(draw, (2, y_pos), display_text, fill="YELLOW", bg="DARKGRAY")
                 else:
-                    draw.text((2, y_pos), display_text, fill="WHITE")
+                    self.draw_text(draw, (2, y_pos), display_text, fill="WHITE", bg=self.get_color("bg"))
                 y_pos += 13
             
             # Bottom help
             draw.rectangle([(0, 115), (127, 127)], fill="DARKGRAY")
-            draw.text((2, 117), "Joy:Edit K3:Save", fill="WHITE")
+            self.draw_text(draw, (2, 117), "Joy:Edit K3:Save", fill="WHITE")
     
     def draw_terminal_only(self, draw, term):
         max_lines = 6
-        total_lines = len(term.output_lines)
-        start_idx = max(0, total_lines - max_lines - term.scroll_offset)
-        end_idx = total_lines - term.scroll_offset
-        visible_lines = term.output_lines[start_idx:end_idx]
+        total_rows = term.screen.total_rows()
+        start_idx = max(0, total_rows - max_lines - term.scroll_offset)
+        end_idx = total_rows - term.scroll_offset
+        visible_lines = term.screen.display_rows(start_idx, end_idx)
         
         y_pos = 12
         for line in visible_lines:
-            draw.text((2, y_pos), line[:21], fill=self.get_color("terminal_output"))
+            self.draw_text(draw, (2, y_pos), line[:21], fill=self.get_color("terminal_output"), bg=self.get_color("bg"))
             y_pos += 13
         
+        # Where a running program will write next, unless it hid the cursor
+        row = term.screen.cursor_row()
+        if term.command_running and row is not None and start_idx <= row < end_idx and term.screen.x < 21:
+            cursor_x = 2 + term.screen.x * 6
+            cursor_y = 12 + (row - start_idx) * 13 + 11
+            draw.line([(cursor_x, cursor_y), (cursor_x + 5, cursor_y)], fill=self.get_color("prompt"))
+        
         draw.rectangle([(0, 90), (127, 127)], fill=self.get_color("bg"))
         
-        prompt = f"{self.username}$"
-        display_text = term.command_input.replace(' ', '_')
+        prompt, display_text = self.input_line(term)
         
         wrapped_lines = []
         first_line_width = 18
@@ -517,14 +2906,14 @@ class PocketTerminal:
         visible_wrapped = wrapped_lines[-3:]
         
         y = 92
-        draw.text((2, y), prompt, fill=self.get_color("prompt"))
+        self.draw_text(draw, (2, y), prompt, fill=self.get_color("prompt"))
         
         if visible_wrapped:
-            draw.text((len(prompt)*6 + 4, y), visible_wrapped[0], fill=self.get_color("fg"))
+            self.draw_text(draw, (len(prompt)*6 + 4, y), visible_wrapped[0], fill=self.get_color("fg"))
         
         for line in visible_wrapped[1:]:
             y += 11
-            draw.text((2, y), line, fill=self.get_color("fg"))
+            self.draw_text(draw, (2, y), line, fill=self.get_color("fg"))
         
         if int(time.time() * 2) % 2 == 0:
             chars_before = term.cursor_pos
@@ -549,14 +2938,91 @@ class PocketTerminal:
                 
                 draw.rectangle([(cursor_x, cursor_y), (cursor_x+5, cursor_y+10)], fill="YELLOW")
         
-        draw.text((2, 115), "Joy:KB K2:Menu K3:Run", fill=self.get_color("prompt"))
+        if term.command_running:
+            self.draw_text(draw, (2, 115), "Joy:KB K2:^C K3:Send", fill=self.get_color("prompt"))
+        else:
+            self.draw_text(draw, (2, 115), "Joy:KB K2:Menu K3:Run", fill=self.get_color("prompt"))
+    
+    def input_line(self, term):
+        """Prompt and shown text for the input line; typing goes to the program while one runs"""
+        if not term.command_running:
+            return f"{self.username}$", term.command_input.replace(' ', '_')
+        if self.password_prompt(term):
+            return "in>", "*" * len(term.command_input)
+        return "in>", term.command_input.replace(' ', '_')
+    
+    def suggestions(self, term):
+        """Whole-command and next-word suggestions for the text before the cursor"""
+        if term.command_running:
+            return []
+        text = term.command_input[:term.cursor_pos]
+        key = (text, term.command_input)
+        if term.suggestion_key == key:
+            return term.suggestion_list
+        
+        if self.predictor is None:
+            self.predictor = CommandPredictor()
+            for cmd in self.history.runs():
+                self.predictor.observe(cmd)
+        
+        found = []
+        if text.strip() and term.cursor_pos == len(term.command_input):
+            matches = self.history.matches(text)
+            if matches:
+                found.append((matches[0], True))
+        found.extend((word, False) for word in self.predictor.suggest(text, SUGGESTIONS - len(found)))
+        
+        term.suggestion_key = key
+        term.suggestion_list = found
+        return found
+    
+    def accept_suggestion(self, term):
+        suggestions = self.suggestions(term)
+        if not suggestions:
+            return
+        label, whole = suggestions[min(term.kb_col, len(suggestions) - 1)]
+        if whole:
+            term.command_input = label
+            term.cursor_pos = len(label)
+        else:
+            before = term.command_input[:term.cursor_pos]
+            if before and not before[-1].isspace():
+                before = before[:before.rfind(' ') + 1]  # replace the word being typed
+            term.command_input = before + label + ' ' + term.command_input[term.cursor_pos:]
+            term.cursor_pos = len(before) + len(label) + 1
+        
+        # Stay on the strip so the next word is one more press away
+        suggestions = self.suggestions(term)
+        if suggestions:
+            term.kb_col = min(term.kb_col, len(suggestions) - 1)
+        else:
+            term.kb_row = 0
+            term.kb_col = 0
+    
+    def draw_suggestions(self, draw, term, suggestions):
+        cell_width = 128 // SUGGESTIONS
+        for i, (label, whole) in enumerate(suggestions):
+            x = i * cell_width
+            selected = term.kb_row == -1 and term.kb_col == i
+            if selected:
+                draw.rectangle([(x, 12), (x+cell_width-2, 22)], fill=self.get_color("select_bg"))
+                fill = self.get_color("select_fg")
+            else:
+                draw.rectangle([(x, 12), (x+cell_width-2, 22)], outline=self.get_color("prompt"))
+                fill = self.get_color("fg") if whole else self.get_color("prompt")
+            self.draw_text(draw, (x+2, 13), label[:(cell_width - 4) // 6], fill=fill)
     
     def draw_terminal_with_keyboard(self, draw, term):
-        if term.output_lines:
-            draw.text((2, 12), term.output_lines[-1][:21], fill=self.get_color("terminal_output"))
+        suggestions = self.suggestions(term)
+        if suggestions:
+            # The strip takes the line that otherwise echoes the last output row
+            self.draw_suggestions(draw, term, suggestions)
+        elif term.screen.total_rows():
+            total_rows = term.screen.total_rows()
+            last_row = term.screen.display_rows(total_rows - 1, total_rows)[0]
+            self.draw_text(draw, (2, 12), last_row[:21], fill=self.get_color("terminal_output"), bg=self.get_color("bg"))
         
-        prompt = f"{self.username}$"
-        display_text = term.command_input.replace(' ', '_')
+        prompt, display_text = self.input_line(term)
         
         first_line_width = 18
         other_line_width = 21
@@ -576,10 +3042,10 @@ class PocketTerminal:
         y = 24
         for idx, line in enumerate(visible_input_lines):
             if idx == 0 and len(wrapped_lines) == len(visible_input_lines):
-                draw.text((2, y), prompt, fill=self.get_color("prompt"))
-                draw.text((len(prompt)*6+4, y), line, fill=self.get_color("fg"))
+                self.draw_text(draw, (2, y), prompt, fill=self.get_color("prompt"))
+                self.draw_text(draw, (len(prompt)*6+4, y), line, fill=self.get_color("fg"))
             else:
-                draw.text((2, y), line, fill=self.get_color("fg"))
+                self.draw_text(draw, (2, y), line, fill=self.get_color("fg"))
             y += 10
         
         chars_before = term.cursor_pos
@@ -607,59 +3073,91 @@ class PocketTerminal:
         separator_y = 24 + (len(visible_input_lines) * 10) + 2
         draw.line([(0, separator_y), (127, separator_y)], fill=self.get_color("prompt"))
         
+        self.draw_keyboard(draw, term, separator_y + 2, 13, 14, 98, 14)
+        
+        caps_indicator = "[CAPS]" if term.caps_lock else f"[{term.kb_page+1}/2]"
+        self.draw_text(draw, (2, 116), caps_indicator, fill=self.get_color("prompt"))
+    
+    def bottom_key_width(self, key):
+        # Eight keys and their gaps have to fit in 128 px
+        if key in ['<-', '->']:
+            return 11
+        return 19 if key in ['CAPS', 'MORE'] else 15
+    
+    def keyboard_layer(self, term, key_height, row_step, bottom_height):
+        """Key grid and bottom row without a highlighted key, rendered once per layout"""
+        cache_key = (self.theme, term.kb_page, term.caps_lock, key_height, row_step, bottom_height)
+        layers = self.keyboard_layers.get(cache_key)
+        if layers is not None:
+            return layers
+        
+        fg = self.get_color("fg")
         current_layout = self.keyboard_layouts[term.kb_page]
         
-        y_kb = separator_y + 2
-        for r, row in enumerate(current_layout):
+        # Transparent layers so they composite exactly like drawing in place.
+        # Labels can hang into the row below, so rows are separate layers
+        # stacked in drawing order
+        rows = []
+        for row in current_layout:
+            layer = Image.new("RGBA", (LCD_WIDTH, row_step + key_height), (0, 0, 0, 0))
+            layer_draw = ImageDraw.Draw(layer)
             x_kb = 2
-            for c, key in enumerate(row):
+            for key in row:
                 key_width = 11
-                
-                display_key = key
-                if term.caps_lock and key.isalpha():
-                    display_key = key.upper()
-                
-                if r == term.kb_row and c == term.kb_col:
-                    draw.rectangle([(x_kb, y_kb), (x_kb+key_width, y_kb+13)], 
-                                 fill=self.get_color("select_bg"))
-                    draw.text((x_kb+3, y_kb+2), display_key, fill=self.get_color("select_fg"))
-                else:
-                    draw.rectangle([(x_kb, y_kb), (x_kb+key_width, y_kb+13)], 
-                                 outline=self.get_color("fg"))
-                    draw.text((x_kb+3, y_kb+2), display_key, fill=self.get_color("fg"))
-                
+                display_key = key.upper() if term.caps_lock and key.isalpha() else key
+                layer_draw.rectangle([(x_kb, 0), (x_kb+key_width, key_height)], outline=fg)
+                layer_draw.text((x_kb+3, 2), display_key, fill=fg)
                 x_kb += key_width + 1
-            y_kb += 14
+            rows.append(layer)
         
-        y_bottom = 98
+        # Bottom row labels overflow into the next key, so each key gets its
+        # own layer and they are stacked in order like the original drawing
+        bottom = []
         x_kb = 0
-        for i, key in enumerate(self.keyboard_bottom_row):
-            if key in ['SPC', 'CAPS', 'BSP', 'CLR', 'MORE']:
-                key_width = 17
-            else:
-                key_width = 14
-            
+        for key in self.keyboard_bottom_row:
+            key_width = self.bottom_key_width(key)
+            layer = Image.new("RGBA", (LCD_WIDTH - x_kb, 2 * bottom_height), (0, 0, 0, 0))
+            layer_draw = ImageDraw.Draw(layer)
             if key == 'CAPS' and term.caps_lock:
-                draw.rectangle([(x_kb, y_bottom), (x_kb+key_width, y_bottom+14)], 
-                             fill="GREEN")
-                draw.text((x_kb+2, y_bottom+2), key, fill="BLACK")
-            elif term.kb_row == 4 and term.kb_col == i:
-                draw.rectangle([(x_kb, y_bottom), (x_kb+key_width, y_bottom+14)], 
-                             fill=self.get_color("select_bg"))
-                draw.text((x_kb+2, y_bottom+2), key, fill=self.get_color("select_fg"))
+                layer_draw.rectangle([(0, 0), (key_width, bottom_height)], fill="GREEN")
+                layer_draw.text((2, 2), key, fill="BLACK")
             else:
-                draw.rectangle([(x_kb, y_bottom), (x_kb+key_width, y_bottom+14)], 
-                             outline=self.get_color("fg"))
-                draw.text((x_kb+2, y_bottom+2), key, fill=self.get_color("fg"))
-            
+                layer_draw.rectangle([(0, 0), (key_width, bottom_height)], outline=fg)
+                layer_draw.text((2, 2), key, fill=fg)
+            bottom.append((x_kb, layer))
             x_kb += key_width + 1
         
-        caps_indicator = "[CAPS]" if term.caps_lock else f"[{term.kb_page+1}/2]"
-        draw.text((2, 116), caps_indicator, fill=self.get_color("prompt"))
+        layers = (rows, bottom)
+        self.keyboard_layers[cache_key] = layers
+        return layers
+    
+    def draw_keyboard(self, draw, term, y_keys, key_height, row_step, y_bottom, bottom_height):
+        """Paste the cached keyboard and draw only the highlighted key on top"""
+        rows, bottom = self.keyboard_layer(term, key_height, row_step, bottom_height)
+        
+        for r, layer in enumerate(rows):
+            y_kb = y_keys + r * row_step
+            self.frame.paste(layer, (0, y_kb), layer)
+            if r == term.kb_row:
+                key = self.keyboard_layouts[term.kb_page][r][term.kb_col]
+                if term.caps_lock and key.isalpha():
+                    key = key.upper()
+                x_kb = 2 + term.kb_col * 12
+                draw.rectangle([(x_kb, y_kb), (x_kb+11, y_kb+key_height)], fill=self.get_color("select_bg"))
+                self.draw_text(draw, (x_kb+3, y_kb+2), key, fill=self.get_color("select_fg"))
+        
+        for i, (x_kb, layer) in enumerate(bottom):
+            key = self.keyboard_bottom_row[i]
+            if term.kb_row == 4 and term.kb_col == i and not (key == 'CAPS' and term.caps_lock):
+                draw.rectangle([(x_kb, y_bottom), (x_kb+self.bottom_key_width(key), y_bottom+bottom_height)], 
+                             fill=self.get_color("select_bg"))
+                self.draw_text(draw, (x_kb+2, y_bottom+2), key, fill=self.get_color("select_fg"))
+            else:
+                self.frame.paste(layer, (x_kb, y_bottom), layer)
     
     def draw_wifi(self, draw):
         draw.rectangle([(0, 0), (127, 12)], fill=self.get_color("title_bg"))
-        draw.text((45, 2), "WiFi", fill=self.get_color("title_fg"))
+        self.draw_text(draw, (45, 2), "WiFi", fill=self.get_color("title_fg"))
         
         if self.entering_wifi_password:
             self.draw_wifi_password_entry(draw)
@@ -669,44 +3167,54 @@ class PocketTerminal:
             
             if self.wifi_menu_section == 0:
                 draw.rectangle([(2, y), (125, y+10)], fill=self.get_color("select_bg"))
-                draw.text((5, y+1), f"Interface: {current_wlan.upper()}", 
+                self.draw_text(draw, (5, y+1), f"Interface: {current_wlan.upper()}", 
                          fill=self.get_color("select_fg"))
             else:
                 draw.rectangle([(2, y), (125, y+10)], outline=self.get_color("fg"))
-                draw.text((5, y+1), f"Interface: {current_wlan.upper()}", 
+                self.draw_text(draw, (5, y+1), f"Interface: {current_wlan.upper()}", 
                          fill=self.get_color("fg"))
             y += 12
             
             wifi_status = "ON" if self.wlan_enabled[current_wlan] else "OFF"
             if self.wifi_menu_section == 1:
                 draw.rectangle([(2, y), (125, y+10)], fill=self.get_color("select_bg"))
-                draw.text((5, y+1), f"WiFi: {wifi_status}", 
+                self.draw_text(draw, (5, y+1), f"Radio (all): {wifi_status}", 
                          fill=self.get_color("select_fg"))
             else:
-                draw.text((5, y+1), f"WiFi: {wifi_status}", fill=self.get_color("prompt"))
+                self.draw_text(draw, (5, y+1), f"Radio (all): {wifi_status}", fill=self.get_color("prompt"))
             y += 12
             
-            if self.wlan_enabled[current_wlan]:
-                draw.text((5, y), "Connected:", fill=self.get_color("fg"))
+            if current_wlan in self.wifi_action:
+                self.draw_text(draw, (5, y), "Status:", fill=self.get_color("fg"))
+                y += 10
+                self.draw_text(draw, (5, y+1), self.wifi_action[current_wlan], fill=self.get_color("prompt"))
+            
+            elif self.wlan_enabled[current_wlan]:
+                self.draw_text(draw, (5, y), "Connected:", fill=self.get_color("fg"))
                 y += 10
                 
                 if self.wifi_connected[current_wlan]:
                     if self.wifi_menu_section == 2:
                         draw.rectangle([(2, y), (125, y+10)], fill=self.get_color("select_bg"))
-                        draw.text((5, y+1), f"{self.wifi_connected[current_wlan][:18]}", 
+                        self.draw_text(draw, (5, y+1), f"{self.wifi_connected[current_wlan][:18]}", 
                                  fill=self.get_color("select_fg"))
                     else:
-                        draw.text((5, y+1), f"{self.wifi_connected[current_wlan][:18]}", fill="GREEN")
+                        self.draw_text(draw, (5, y+1), f"{self.wifi_connected[current_wlan][:18]}", fill="GREEN")
                     y += 12
                 else:
-                    draw.text((5, y+1), "None", fill=self.get_color("fg"))
+                    self.draw_text(draw, (5, y+1), "None", fill=self.get_color("fg"))
                     y += 12
                 
-                draw.text((5, y), "Available:", fill=self.get_color("fg"))
+                self.draw_text(draw, (5, y), "Available:", fill=self.get_color("fg"))
+                age = self.wifi_age(current_wlan)
+                self.draw_text(draw, (125 - len(age) * 6, y), age, fill=self.get_color("prompt"))
                 y += 10
                 
                 if not self.wifi_networks[current_wlan]:
-                    draw.text((20, y), "Scanning...", fill=self.get_color("fg"))
+                    if current_wlan in self.wifi_scanned:
+                        self.draw_text(draw, (20, y), "No networks", fill=self.get_color("fg"))
+                    else:
+                        self.draw_text(draw, (20, y), "Scanning...", fill=self.get_color("fg"))
                 else:
                     for i, net in enumerate(self.wifi_networks[current_wlan]):
                         if y > 110:
@@ -721,97 +3229,49 @@ class PocketTerminal:
                         
                         ssid = net['ssid'][:15]
                         signal = net['signal']
-                        draw.text((5, y), f"{ssid} {signal}%", fill=text_color)
+                        self.draw_text(draw, (5, y), f"{ssid} {signal}%", fill=text_color)
                         y += 10
             
-            draw.text((2, 118), "K3:Select K2:Back", fill=self.get_color("prompt"))
+            self.draw_text(draw, (2, 118), "K3:Select K2:Back", fill=self.get_color("prompt"))
     
     def draw_wifi_password_entry(self, draw):
         term = self.terminal
-        current_wlan = self.get_current_wlan()
         
-        net_idx = self.wifi_menu_section - 3
-        if 0 <= net_idx < len(self.wifi_networks[current_wlan]):
-            selected_net = self.wifi_networks[current_wlan][net_idx]
-            draw.text((5, 14), f"Join: {selected_net['ssid'][:15]}", fill=self.get_color("fg"))
+        if self.wifi_join_ssid:
+            self.draw_text(draw, (5, 14), f"Join: {self.wifi_join_ssid[:15]}", fill=self.get_color("fg"))
         
-        draw.text((5, 26), "Password:", fill=self.get_color("prompt"))
+        self.draw_text(draw, (5, 26), "Password:", fill=self.get_color("prompt"))
         masked = '*' * len(self.wifi_password_input)
-        draw.text((5, 38), masked[:20], fill=self.get_color("fg"))
+        self.draw_text(draw, (5, 38), masked[:20], fill=self.get_color("fg"))
         
         draw.line([(0, 50), (127, 50)], fill=self.get_color("prompt"))
         
-        current_layout = self.keyboard_layouts[term.kb_page]
-        
-        y_kb = 52
-        for r, row in enumerate(current_layout):
-            x_kb = 2
-            for c, key in enumerate(row):
-                key_width = 11
-                
-                display_key = key
-                if term.caps_lock and key.isalpha():
-                    display_key = key.upper()
-                
-                if r == term.kb_row and c == term.kb_col:
-                    draw.rectangle([(x_kb, y_kb), (x_kb+key_width, y_kb+11)], 
-                                 fill=self.get_color("select_bg"))
-                    draw.text((x_kb+3, y_kb+2), display_key, fill=self.get_color("select_fg"))
-                else:
-                    draw.rectangle([(x_kb, y_kb), (x_kb+key_width, y_kb+11)], 
-                                 outline=self.get_color("fg"))
-                    draw.text((x_kb+3, y_kb+2), display_key, fill=self.get_color("fg"))
-                
-                x_kb += key_width + 1
-            y_kb += 12
-        
-        y_bottom = 106
-        x_kb = 0
-        for i, key in enumerate(self.keyboard_bottom_row):
-            if key in ['SPC', 'CAPS', 'BSP', 'CLR', 'MORE']:
-                key_width = 17
-            else:
-                key_width = 14
-            
-            if key == 'CAPS' and term.caps_lock:
-                draw.rectangle([(x_kb, y_bottom), (x_kb+key_width, y_bottom+12)], 
-                             fill="GREEN")
-                draw.text((x_kb+2, y_bottom+2), key, fill="BLACK")
-            elif term.kb_row == 4 and term.kb_col == i:
-                draw.rectangle([(x_kb, y_bottom), (x_kb+key_width, y_bottom+12)], 
-                             fill=self.get_color("select_bg"))
-                draw.text((x_kb+2, y_bottom+2), key, fill=self.get_color("select_fg"))
-            else:
-                draw.rectangle([(x_kb, y_bottom), (x_kb+key_width, y_bottom+12)], 
-                             outline=self.get_color("fg"))
-                draw.text((x_kb+2, y_bottom+2), key, fill=self.get_color("fg"))
-            
-            x_kb += key_width + 1
+        self.draw_keyboard(draw, term, 52, 11, 12, 106, 12)
     
     def draw_settings(self, draw):
         draw.rectangle([(0, 0), (127, 12)], fill=self.get_color("title_bg"))
-        draw.text((40, 2), "SETTINGS", fill=self.get_color("title_fg"))
+        self.draw_text(draw, (40, 2), "SETTINGS", fill=self.get_color("title_fg"))
         
         if self.in_theme_select:
             y = 20
-            draw.text((5, y), "Select Theme:", fill=self.get_color("fg"))
+            self.draw_text(draw, (5, y), "Select Theme:", fill=self.get_color("fg"))
             y += 15
             
             for i, theme_name in enumerate(self.theme_options):
                 if i == self.theme_select_index:
                     draw.rectangle([(10, y), (115, y+13)], fill=self.get_color("select_bg"))
-                    draw.text((15, y+2), f"> {theme_name.title()}", 
+                    self.draw_text(draw, (15, y+2), f"> {theme_name.title()}", 
                              fill=self.get_color("select_fg"))
                 else:
-                    draw.text((15, y+2), f"  {theme_name.title()}", 
+                    self.draw_text(draw, (15, y+2), f"  {theme_name.title()}", 
                              fill=self.get_color("fg"))
                 y += 15
             
-            draw.text((5, 112), "K3:Select K2:Back", fill=self.get_color("prompt"))
+            self.draw_text(draw, (5, 112), "K3:Select K2:Back", fill=self.get_color("prompt"))
         
         elif self.in_brightness_adjust:
             y = 30
-            draw.text((20, y), "BRIGHTNESS", fill=self.get_color("fg"))
+            self.draw_text(draw, (20, y), "BRIGHTNESS", fill=self.get_color("fg"))
             y += 20
             
             bar_width = int(self.brightness * 1.0)
@@ -821,83 +3281,195 @@ class PocketTerminal:
                              fill=self.get_color("select_bg"))
             
             y += 20
-            draw.text((45, y), f"{self.brightness}%", fill=self.get_color("fg"))
+            self.draw_text(draw, (45, y), f"{self.brightness}%", fill=self.get_color("fg"))
             
             y += 25
-            draw.text((20, y), "<     -  +     >", fill=self.get_color("prompt"))
+            self.draw_text(draw, (20, y), "<     -  +     >", fill=self.get_color("prompt"))
             
-            draw.text((25, 112), "K2: Back", fill=self.get_color("prompt"))
+            self.draw_text(draw, (25, 112), "K2: Back", fill=self.get_color("prompt"))
         
         else:
             items = [
                 f"Theme: {self.theme.title()}",
-                f"Brightness: {self.brightness}%"
+                f"Brightness: {self.brightness}%",
+                f"Shell: {'Persistent' if self.persistent_shell else 'Per cmd'}"
             ]
             
             y = 25
             for i, item in enumerate(items):
                 if i == self.settings_menu_index:
                     draw.rectangle([(5, y), (122, y+15)], fill=self.get_color("select_bg"))
-                    draw.text((10, y+2), f"> {item}", fill=self.get_color("select_fg"))
+                    self.draw_text(draw, (10, y+2), f"> {item}", fill=self.get_color("select_fg"))
                 else:
-                    draw.text((10, y+2), f"  {item}", fill=self.get_color("fg"))
+                    self.draw_text(draw, (10, y+2), f"  {item}", fill=self.get_color("fg"))
                 y += 18
             
-            draw.text((5, 112), "K3:Change K2:Back", fill=self.get_color("prompt"))
+            self.draw_text(draw, (5, 112), "K3:Change K2:Back", fill=self.get_color("prompt"))
     
     def draw_about(self, draw):
         draw.rectangle([(0, 0), (127, 12)], fill=self.get_color("title_bg"))
-        draw.text((45, 2), "ABOUT", fill=self.get_color("title_fg"))
+        self.draw_text(draw, (45, 2), "ABOUT", fill=self.get_color("title_fg"))
         
-        if not self.system_info:
-            self.get_system_info()
+        info = self.about_shown = self.system_info.snapshot()
         
         y = 18
-        draw.text((5, y), "Device:", fill=self.get_color("fg"))
+        self.draw_text(draw, (5, y), "Device:", fill=self.get_color("fg"))
         y += 10
-        model = self.system_info.get('model', 'Unknown')
+        model = info['model']
         if len(model) > 21:
-            draw.text((5, y), model[:21], fill=self.get_color("terminal_output"))
+            self.draw_text(draw, (5, y), model[:21], fill=self.get_color("terminal_output"))
             y += 10
-            draw.text((5, y), model[21:42], fill=self.get_color("terminal_output"))
+            self.draw_text(draw, (5, y), model[21:42], fill=self.get_color("terminal_output"))
         else:
-            draw.text((5, y), model, fill=self.get_color("terminal_output"))
+            self.draw_text(draw, (5, y), model, fill=self.get_color("terminal_output"))
         
         y += 12
-        draw.text((5, y), self.system_info.get('temp', 'N/A'), fill=self.get_color("fg"))
+        self.draw_text(draw, (5, y), info['temp'], fill=self.get_color("fg"))
         
         y += 12
-        draw.text((5, y), "Firmware:", fill=self.get_color("fg"))
+        self.draw_text(draw, (5, y), "Firmware:", fill=self.get_color("fg"))
         y += 10
-        draw.text((5, y), self.system_info.get('firmware', 'N/A')[:21], 
+        self.draw_text(draw, (5, y), info['firmware'][:21], 
                  fill=self.get_color("terminal_output"))
         
         y += 12
-        uptime = self.system_info.get('uptime', 'N/A')
-        draw.text((5, y), uptime[:21], fill=self.get_color("fg"))
+        uptime = info['uptime']
+        self.draw_text(draw, (5, y), uptime[:21], fill=self.get_color("fg"))
         
-        draw.text((40, 115), "K2: Back", fill=self.get_color("prompt"))
+        self.draw_text(draw, (40, 115), "K2: Back", fill=self.get_color("prompt"))
     
-    # ==================== INPUT HANDLING ====================
+    def format_rate(self, rate):
+        if rate >= 1048576:
+            return f"{rate / 1048576:.1f}M"
+        if rate >= 1024:
+            return f"{rate / 1024:.0f}K"
+        return f"{rate:.0f}B"
+    
+    def draw_sparkline(self, draw, box, ring, low, high):
+        """Plot a ring's history newest-right inside box, scaled to low..high"""
+        x0, y0, x1, y1 = box
+        draw.rectangle([(x0, y0), (x1, y1)], outline=self.get_color("title_bg"))
+        values = ring.values()
+        if not values:
+            return
+        span = (high - low) or 1
+        height = y1 - y0 - 2
+        x = x1 - 1 - len(values) + 1
+        points = []
+        for value in values:
+            level = min(max((value - low) / span, 0), 1)
+            points.append((x, y1 - 1 - round(level * height)))
+            x += 1
+        if len(points) == 1:
+            draw.point(points, fill=self.get_color("terminal_output"))
+        else:
+            draw.line(points, fill=self.get_color("terminal_output"))
     
-    def handle_input(self):
-        current_time = time.time()
+    def draw_monitor(self, draw):
+        draw.rectangle([(0, 0), (127, 12)], fill=self.get_color("title_bg"))
+        self.draw_text(draw, (40, 2), "MONITOR", fill=self.get_color("title_fg"))
+        
+        metrics = self.metrics
+        load_high = max(1.0, max(metrics.load.values(), default=0))
+        net_high = max(1024.0, max(metrics.net.values(), default=0))
+        rows = [
+            ("CPU", f"{metrics.cpu.last():.0f}%", metrics.cpu, 0, 100),
+            ("Load", f"{metrics.load.last():.2f}", metrics.load, 0, load_high),
+            ("Mem", f"{metrics.mem.last():.0f}%", metrics.mem, 0, 100),
+            ("Temp", f"{metrics.temp.last():.0f}'C", metrics.temp, 30, 85),
+            ("Net", self.format_rate(metrics.net.last()), metrics.net, 0, net_high),
+        ]
+        
+        y = 15
+        for label, value, ring, low, high in rows:
+            if not ring.count:
+                value = "N/A"
+            self.draw_text(draw, (2, y), label, fill=self.get_color("fg"))
+            self.draw_text(draw, (2, y + 8), value, fill=self.get_color("terminal_output"))
+            self.draw_sparkline(draw, (60, y, 60 + METRIC_SAMPLES + 1, y + 15), ring, low, high)
+            y += 18
+        
+        state = metrics.throttle_state()
+        if state is not None:
+            color = self.get_color("fg") if state.startswith("OK") else self.get_color("status_running")
+            self.draw_text(draw, (2, y), state[:21], fill=color)
         
+        self.draw_text(draw, (40, 115), "K2: Back", fill=self.get_color("prompt"))
+    
+    # ==================== INPUT HANDLING ====================
+    
+    def on_button_events(self):
+        for event in self.buttons.pending():
+            self.inputs.feed(event)
+    
+    def handle_input(self, event):
         # KEY1 for shutdown/reboot (WORKS EVERYWHERE)
-        if GPIO.input(KEY1_PIN) == GPIO.LOW:
-            if self.key1_press_start == 0:
-                self.key1_press_start = current_time
-            elif current_time - self.key1_press_start >= self.shutdown_threshold:
+        if event.pin == KEY1_PIN:
+            if event.kind == LONG_PRESS:
                 self.shutdown_pi()
-                return
-        else:
-            if self.key1_press_start > 0:
-                press_duration = current_time - self.key1_press_start
-                if press_duration >= self.reboot_threshold and press_duration < self.shutdown_threshold:
+            elif event.kind == RELEASE and not event.chorded:
+                # A release after a chord (KEY1 + another button) never reboots
+                if event.duration >= self.reboot_threshold and event.duration < self.shutdown_threshold:
                     self.reboot_pi()
-                    return
-                self.key1_press_start = 0
+            return
+        
+        if event.kind == CHORD:
+            self.handle_chord(event.pin)
+            return
+        
+        if event.kind not in (PRESS, REPEAT):
+            return
+        
+        self.current_event = event
+        try:
+            self.dispatch_input()
+        finally:
+            self.current_event = None
+    
+    def handle_chord(self, pin):
+        """KEY1 held + LEFT/RIGHT: switch tab, + PRESS: new tab, + KEY2: close tab, + KEY3: ^D"""
+        if self.current_screen != "terminal":
+            return
+        if pin == KEY_LEFT_PIN:
+            self.switch_session(-1)
+        elif pin == KEY_RIGHT_PIN:
+            self.switch_session(1)
+        elif pin == KEY_PRESS_PIN:
+            self.open_session()
+        elif pin == KEY2_PIN:
+            self.close_session()
+        elif pin == KEY3_PIN and self.terminal.command_running:
+            # ^D: end of input, or flush the typed text without a newline
+            self.send_input_line(self.terminal, "\x04")
+    
+    def select_session(self, index):
+        self.terminal = self.sessions[index]
+        self.terminal.unseen_output = False
+        self.request_redraw()
+    
+    def switch_session(self, step):
+        index = self.sessions.index(self.terminal)
+        self.select_session((index + step) % len(self.sessions))
+    
+    def open_session(self):
+        if len(self.sessions) < MAX_SESSIONS:
+            self.sessions.append(Terminal())
+            self.select_session(len(self.sessions) - 1)
+    
+    def close_session(self):
+        term = self.terminal
+        index = self.sessions.index(term)
+        self.kill_process(term)
+        self.finish_process(term)
+        self.close_pager(term)
+        self.close_nano(term)
         
+        self.sessions.pop(index)
+        if not self.sessions:
+            self.sessions.append(Terminal())
+        self.select_session(min(index, len(self.sessions) - 1))
+    
+    def dispatch_input(self):
         if self.current_screen == "menu":
             self.handle_menu_input()
         elif self.current_screen == "terminal":
@@ -906,36 +3478,34 @@ class PocketTerminal:
             self.handle_wifi_input()
         elif self.current_screen == "settings":
             self.handle_settings_input()
-        elif self.current_screen == "about":
+        elif self.current_screen in ("about", "monitor"):
             if self.button_pressed(KEY2_PIN):
                 self.current_screen = "menu"
-                self.draw_screen()
+                self.request_redraw()
     
     def handle_menu_input(self):
-        if self.button_pressed(KEY_UP_PIN, 0.15):
-            self.menu_index = (self.menu_index - 1) % 4
-            self.draw_screen()
+        if self.button_pressed(KEY_UP_PIN):
+            self.menu_index = (self.menu_index - 1) % 5
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_DOWN_PIN, 0.15):
-            self.menu_index = (self.menu_index + 1) % 4
-            self.draw_screen()
+        elif self.button_pressed(KEY_DOWN_PIN):
+            self.menu_index = (self.menu_index + 1) % 5
+            self.request_redraw()
         
-        elif self.button_pressed(KEY3_PIN, 0.15):
+        elif self.button_pressed(KEY3_PIN):
             if self.menu_index == 0:
                 self.current_screen = "terminal"
             elif self.menu_index == 1:
                 self.current_screen = "wifi"
                 self.wifi_menu_section = 0
-                current_wlan = self.get_current_wlan()
                 self.check_all_wlan_status()
-                if self.wlan_enabled[current_wlan]:
-                    self.scan_wifi(current_wlan)
             elif self.menu_index == 2:
-                self.current_screen = "settings"
+                self.current_screen = "monitor"
             elif self.menu_index == 3:
+                self.current_screen = "settings"
+            elif self.menu_index == 4:
                 self.current_screen = "about"
-                self.get_system_info()
-            self.draw_screen()
+            self.request_redraw()
     
     def handle_terminal_input(self):
         term = self.terminal
@@ -943,6 +3513,8 @@ class PocketTerminal:
         # Check if in nano mode
         if term.in_nano:
             self.handle_nano_input(term)
+        elif term.pager is not None:
+            self.handle_pager_input(term)
         elif term.keyboard_visible:
             self.handle_keyboard_input()
         else:
@@ -953,50 +3525,45 @@ class PocketTerminal:
         
         if term.nano_asking_exit:
             # In exit dialog
-            if self.button_pressed(KEY3_PIN, 0.2):
+            if self.button_pressed(KEY3_PIN):
                 # Exit without saving
-                term.in_nano = False
+                self.close_nano(term)
                 term.nano_asking_exit = False
-                self.draw_screen()
-            elif self.button_pressed(KEY2_PIN, 0.2):
+                self.request_redraw()
+            elif self.button_pressed(KEY2_PIN):
                 # Cancel - go back to editing
                 term.nano_asking_exit = False
-                self.draw_screen()
+                self.request_redraw()
         
         elif term.keyboard_visible:
             # Keyboard mode in nano
-            if self.button_pressed(KEY3_PIN, 0.18):
+            if self.button_pressed(KEY3_PIN):
                 if term.kb_row == 4:
                     key = self.keyboard_bottom_row[term.kb_col]
                 else:
                     current_layout = self.keyboard_layouts[term.kb_page]
                     key = current_layout[term.kb_row][term.kb_col]
                 
-                # Ensure current line exists
-                while len(term.nano_lines) <= term.nano_current_line:
-                    term.nano_lines.append("")
-                
-                current_line = term.nano_lines[term.nano_current_line]
+                buffer = term.nano_buffer
                 
                 if key == 'SPC':
-                    term.nano_lines[term.nano_current_line] = current_line[:term.nano_cursor] + ' ' + current_line[term.nano_cursor:]
-                    term.nano_cursor += 1
+                    buffer.insert(' ')
+                    term.nano_modified = True
+                elif key == 'TAB':
+                    buffer.insert('    ')
                     term.nano_modified = True
                 elif key == 'CAPS':
                     term.caps_lock = not term.caps_lock
                 elif key == 'BSP':
-                    if term.nano_cursor > 0:
-                        term.nano_lines[term.nano_current_line] = current_line[:term.nano_cursor-1] + current_line[term.nano_cursor:]
-                        term.nano_cursor -= 1
+                    if buffer.backspace():
                         term.nano_modified = True
                 elif key == 'CLR':
-                    term.nano_lines[term.nano_current_line] = ""
-                    term.nano_cursor = 0
+                    buffer.clear_line()
                     term.nano_modified = True
                 elif key == '<-':
-                    term.nano_cursor = max(0, term.nano_cursor - 1)
+                    buffer.move(-1)
                 elif key == '->':
-                    term.nano_cursor = min(len(current_line), term.nano_cursor + 1)
+                    buffer.move(1)
                 elif key == 'MORE':
                     term.kb_page = 1 - term.kb_page
                     term.kb_row = 0
@@ -1004,87 +3571,83 @@ class PocketTerminal:
                 else:
                     if term.caps_lock and key.isalpha():
                         key = key.upper()
-                    term.nano_lines[term.nano_current_line] = current_line[:term.nano_cursor] + key + current_line[term.nano_cursor:]
-                    term.nano_cursor += 1
+                    buffer.insert(key)
                     term.nano_modified = True
                 
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY_PRESS_PIN, 0.15):
+            elif self.button_pressed(KEY_PRESS_PIN):
                 term.keyboard_visible = False
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY_UP_PIN, 0.12):
+            elif self.button_pressed(KEY_UP_PIN):
                 term.kb_row = max(0, term.kb_row - 1)
                 if term.kb_row < 4:
                     term.kb_col = min(term.kb_col, len(self.keyboard_layouts[term.kb_page][term.kb_row]) - 1)
                 else:
                     term.kb_col = min(term.kb_col, len(self.keyboard_bottom_row) - 1)
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY_DOWN_PIN, 0.12):
+            elif self.button_pressed(KEY_DOWN_PIN):
                 term.kb_row = min(4, term.kb_row + 1)
                 if term.kb_row < 4:
                     term.kb_col = min(term.kb_col, len(self.keyboard_layouts[term.kb_page][term.kb_row]) - 1)
                 else:
                     term.kb_col = min(term.kb_col, len(self.keyboard_bottom_row) - 1)
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY_LEFT_PIN, 0.12):
+            elif self.button_pressed(KEY_LEFT_PIN):
                 term.kb_col = max(0, term.kb_col - 1)
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY_RIGHT_PIN, 0.12):
+            elif self.button_pressed(KEY_RIGHT_PIN):
                 if term.kb_row < 4:
                     term.kb_col = min(len(self.keyboard_layouts[term.kb_page][term.kb_row]) - 1, term.kb_col + 1)
                 else:
                     term.kb_col = min(len(self.keyboard_bottom_row) - 1, term.kb_col + 1)
-                self.draw_screen()
+                self.request_redraw()
         
         else:
             # Nano normal mode (viewing/navigating)
-            if self.button_pressed(KEY_PRESS_PIN, 0.15):
+            if self.button_pressed(KEY_PRESS_PIN):
+                buffer = term.nano_buffer
+                if buffer.row >= len(buffer.lines) and not buffer.ready():
+                    return  # line not indexed yet
+                # Set cursor to end of line
+                buffer.focus(buffer.row, len(buffer.line(buffer.row)))
+                
                 # Open keyboard to edit current line
                 term.keyboard_visible = True
                 term.kb_row = 0
                 term.kb_col = 0
-                # Set cursor to end of line
-                if term.nano_current_line < len(term.nano_lines):
-                    term.nano_cursor = len(term.nano_lines[term.nano_current_line])
-                else:
-                    term.nano_cursor = 0
-                self.draw_screen()
-            
-            elif self.button_pressed(KEY_UP_PIN, 0.15):
-                # Move to previous line
-                if term.nano_current_line > 0:
-                    term.nano_current_line -= 1
-                    # Adjust cursor if line is shorter
-                    if term.nano_current_line < len(term.nano_lines):
-                        term.nano_cursor = min(term.nano_cursor, len(term.nano_lines[term.nano_current_line]))
-                    self.draw_screen()
-            
-            elif self.button_pressed(KEY_DOWN_PIN, 0.15):
-                # Move to next line (create if needed)
-                term.nano_current_line += 1
-                while len(term.nano_lines) <= term.nano_current_line:
-                    term.nano_lines.append("")
-                term.nano_cursor = min(term.nano_cursor, len(term.nano_lines[term.nano_current_line]))
-                self.draw_screen()
-            
-            elif self.button_pressed(KEY3_PIN, 0.2):
+                self.request_redraw()
+            
+            elif self.button_pressed(KEY_UP_PIN):
+                # Move to previous line, cursor clamped if it is shorter
+                buffer = term.nano_buffer
+                if buffer.row > 0:
+                    buffer.focus(max(0, buffer.row - self.held_step()), buffer.cursor)
+                    self.request_redraw()
+            
+            elif self.button_pressed(KEY_DOWN_PIN):
+                # Move to next line (create one if needed, never more)
+                buffer = term.nano_buffer
+                buffer.focus(min(buffer.row + self.held_step(), len(buffer)), buffer.cursor)
+                self.request_redraw()
+            
+            elif self.button_pressed(KEY3_PIN):
                 # Save and exit
                 self.nano_save_and_exit(term)
             
-            elif self.button_pressed(KEY2_PIN, 0.2):
+            elif self.button_pressed(KEY2_PIN):
                 # Ask to exit without saving
                 if term.nano_modified:
                     term.nano_asking_exit = True
-                    self.draw_screen()
+                    self.request_redraw()
                 else:
                     # No modifications, just exit
-                    term.in_nano = False
-                    self.draw_screen()
+                    self.close_nano(term)
+                    self.request_redraw()
     
     def nano_save_and_exit(self, term):
         """Save nano file and exit"""
@@ -1096,29 +3659,124 @@ class PocketTerminal:
                 filepath = os.path.join(term.working_dir, term.nano_filename)
             
             # Only save if modified or if new file with content
-            if term.nano_modified or (not os.path.exists(filepath) and any(line.strip() for line in term.nano_lines)):
+            buffer = term.nano_buffer
+            if isinstance(buffer.lines, LineOverlay):
+                if term.nano_modified:
+                    # The original stays mapped while the new copy is written next to it
+                    buffer.commit()
+                    temp_path = f"{filepath}.pocket-{os.getpid()}"
+                    try:
+                        with open(temp_path, 'wb') as f:
+                            buffer.lines.write_to(f)
+                        shutil.copymode(filepath, temp_path)
+                        os.replace(temp_path, filepath)
+                    except:
+                        if os.path.exists(temp_path):
+                            os.unlink(temp_path)
+                        raise
+                    term.screen.write_line(f"Saved: {term.nano_filename[:14]}")
+            elif term.nano_modified or (not os.path.exists(filepath) and buffer.has_content()):
                 with open(filepath, 'w') as f:
-                    f.write('\n'.join(term.nano_lines))
-                term.output_lines.append(f"Saved: {term.nano_filename[:14]}")
+                    buffer.write_to(f)
+                term.screen.write_line(f"Saved: {term.nano_filename[:14]}")
             
-            term.in_nano = False
-            self.draw_screen()
+            self.close_nano(term)
+            self.request_redraw()
         except Exception as e:
-            term.output_lines.append(f"Save error: {str(e)[:10]}")
-            term.in_nano = False
-            self.draw_screen()
+            term.screen.write_line(f"Save error: {str(e)[:10]}")
+            self.close_nano(term)
+            self.request_redraw()
+    
+    def close_nano(self, term):
+        term.in_nano = False
+        if isinstance(term.nano_buffer.lines, LineOverlay):
+            term.nano_buffer.lines.base.close()
+        term.nano_buffer = TextBuffer()
+    
+    def open_mapped(self, path):
+        """Map a file and index its lines on a thread of its own, redrawing as they arrive
+        
+        Not on the worker: a few slow nmcli jobs would hold up the first screenful.
+        """
+        lines = MappedLines(path)
+        if not lines.complete:
+            progress = lambda: self.loop.call_soon_threadsafe(self.request_redraw)
+            threading.Thread(target=lines.build_index, args=(progress,), daemon=True).start()
+        return lines
+    
+    # ==================== PAGER ====================
+    
+    def open_pager(self, term, filename, filepath):
+        try:
+            term.pager = self.open_mapped(filepath)
+        except OSError as e:
+            term.screen.write_line(f"less: {e.strerror}")
+            return
+        term.pager_filename = filename
+        term.pager_top = 0
+    
+    def close_pager(self, term):
+        if term.pager is not None:
+            term.pager.close()
+            term.pager = None
+    
+    def draw_pager(self, draw, term):
+        pager = term.pager
+        total = len(pager)
+        draw.rectangle([(0, 0), (127, 10)], fill=self.get_color("title_bg"))
+        name = term.pager_filename if len(term.pager_filename) <= 9 else "..." + term.pager_filename[-6:]
+        position = f"{min(term.pager_top + 1, total)}/{total}" + ("" if pager.complete else "+")
+        self.draw_text(draw, (2, 1), name, fill=self.get_color("title_fg"))
+        self.draw_text(draw, (127 - len(position) * 6, 1), position, fill=self.get_color("title_fg"))
+        
+        y_pos = 12
+        for i in range(term.pager_top, min(total, term.pager_top + PAGER_ROWS)):
+            self.draw_text(draw, (2, y_pos), pager[i][:21], fill=self.get_color("terminal_output"), bg=self.get_color("bg"))
+            y_pos += 13
+        
+        draw.rectangle([(0, 115), (127, 127)], fill="DARKGRAY")
+        self.draw_text(draw, (2, 117), "Joy:Scroll K3:End", fill="WHITE")
+    
+    def handle_pager_input(self, term):
+        last_top = max(0, len(term.pager) - PAGER_ROWS)
+        if self.button_pressed(KEY_UP_PIN):
+            term.pager_top = max(0, term.pager_top - self.held_step())
+        elif self.button_pressed(KEY_DOWN_PIN):
+            term.pager_top = min(last_top, term.pager_top + self.held_step())
+        elif self.button_pressed(KEY_LEFT_PIN):
+            term.pager_top = max(0, term.pager_top - PAGER_ROWS)
+        elif self.button_pressed(KEY_RIGHT_PIN):
+            term.pager_top = min(last_top, term.pager_top + PAGER_ROWS)
+        elif self.button_pressed(KEY3_PIN):
+            # Jump between the end (as far as it is indexed) and the top
+            term.pager_top = 0 if term.pager_top >= last_top else last_top
+        elif self.button_pressed(KEY2_PIN):
+            self.close_pager(term)
+        else:
+            return
+        self.request_redraw()
     
     def handle_keyboard_input(self):
         term = self.terminal
         
-        if self.button_pressed(KEY3_PIN, 0.18):
+        if self.button_pressed(KEY3_PIN) and term.kb_row == -1:
+            term.completion = None
+            self.accept_suggestion(term)
+            self.request_redraw()
+        
+        elif self.button_pressed(KEY3_PIN):
             if term.kb_row == 4:
                 key = self.keyboard_bottom_row[term.kb_col]
             else:
                 current_layout = self.keyboard_layouts[term.kb_page]
                 key = current_layout[term.kb_row][term.kb_col]
             
-            if key == 'SPC':
+            if key != 'TAB':
+                term.completion = None
+            
+            if key == 'TAB':
+                self.complete_input(term)
+            elif key == 'SPC':
                 term.command_input = term.command_input[:term.cursor_pos] + ' ' + term.command_input[term.cursor_pos:]
                 term.cursor_pos += 1
             elif key == 'CAPS':
@@ -1144,106 +3802,160 @@ class PocketTerminal:
                 term.command_input = term.command_input[:term.cursor_pos] + key + term.command_input[term.cursor_pos:]
                 term.cursor_pos += 1
             
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_PRESS_PIN, 0.15):
+        elif self.button_pressed(KEY_PRESS_PIN):
             term.keyboard_visible = False
-            if term.command_input.strip():
+            if term.command_running:
+                # The running program is waiting on input: it gets the line,
+                # but closing the keyboard alone must not answer a prompt
+                if term.command_input:
+                    self.send_input_line(term, "\n")
+            elif term.command_input.strip():
                 self.execute_command(term)
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_UP_PIN, 0.12):
-            term.kb_row = max(0, term.kb_row - 1)
-            if term.kb_row < 4:
+        elif self.button_pressed(KEY_UP_PIN):
+            # Above the top row is the suggestion strip (row -1), when it has anything
+            suggestions = self.suggestions(term)
+            term.kb_row = max(-1 if suggestions else 0, term.kb_row - 1)
+            if term.kb_row == -1:
+                term.kb_col = min(term.kb_col, len(suggestions) - 1)
+            elif term.kb_row < 4:
                 term.kb_col = min(term.kb_col, len(self.keyboard_layouts[term.kb_page][term.kb_row]) - 1)
             else:
                 term.kb_col = min(term.kb_col, len(self.keyboard_bottom_row) - 1)
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_DOWN_PIN, 0.12):
+        elif self.button_pressed(KEY_DOWN_PIN):
             term.kb_row = min(4, term.kb_row + 1)
             if term.kb_row < 4:
                 term.kb_col = min(term.kb_col, len(self.keyboard_layouts[term.kb_page][term.kb_row]) - 1)
             else:
                 term.kb_col = min(term.kb_col, len(self.keyboard_bottom_row) - 1)
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_LEFT_PIN, 0.12):
+        elif self.button_pressed(KEY_LEFT_PIN):
             term.kb_col = max(0, term.kb_col - 1)
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_RIGHT_PIN, 0.12):
-            if term.kb_row < 4:
+        elif self.button_pressed(KEY_RIGHT_PIN):
+            if term.kb_row == -1:
+                term.kb_col = min(len(self.suggestions(term)) - 1, term.kb_col + 1)
+            elif term.kb_row < 4:
                 term.kb_col = min(len(self.keyboard_layouts[term.kb_page][term.kb_row]) - 1, term.kb_col + 1)
             else:
                 term.kb_col = min(len(self.keyboard_bottom_row) - 1, term.kb_col + 1)
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY2_PIN, 0.15):
+        elif self.button_pressed(KEY2_PIN):
             term.keyboard_visible = False
-            self.draw_screen()
+            self.request_redraw()
+    
+    def complete_input(self, term):
+        """TAB: complete the word before the cursor; pressed again, cycle the candidates"""
+        state = term.completion
+        if state is not None and state[0] == term.command_input:
+            _, start, candidates, index = state
+            index = (index + 1) % len(candidates)
+            replacement = candidates[index]
+        else:
+            before = term.command_input[:term.cursor_pos]
+            start = before.rfind(' ') + 1
+            word = before[start:]
+            matches = self.completer.complete(word, not before[:start].strip(), term.working_dir)
+            if not matches:
+                return
+            candidates = [text + '/' if is_dir else text for text, is_dir in matches]
+            index = -1
+            if len(candidates) == 1:
+                replacement = candidates[0] if matches[0][1] else candidates[0] + ' '
+                candidates = []
+            else:
+                # Extend to what they all share; the next press starts cycling
+                replacement = os.path.commonprefix(candidates)
+                if len(replacement) <= len(word):
+                    index = 0
+                    replacement = candidates[0]
+        
+        # The word (or the previous candidate) runs from start to the cursor
+        after = term.command_input[term.cursor_pos:]
+        term.command_input = term.command_input[:start] + replacement + after
+        term.cursor_pos = start + len(replacement)
+        term.completion = (term.command_input, start, candidates, index) if candidates else None
     
     def handle_terminal_mode_input(self):
         term = self.terminal
         
-        if self.button_pressed(KEY2_PIN, 0.2):
-            if term.process:
-                try:
-                    os.killpg(os.getpgid(term.process.pid), 9)
-                    term.output_lines.append("^C Stopped")
-                    term.process = None
-                except:
-                    pass
-                self.draw_screen()
+        if self.button_pressed(KEY2_PIN):
+            if term.command_running:
+                now = time.monotonic()
+                if now - term.interrupt_time < 2.0:
+                    # Ignored the ^C: kill it
+                    try:
+                        self.stop_command(term)
+                        term.screen.write_line("^C Stopped")
+                    except:
+                        pass
+                    term.interrupt_time = 0
+                else:
+                    self.send_to_process(term, b'\x03')
+                    term.interrupt_time = now
+                self.request_redraw()
             else:
                 self.current_screen = "menu"
-                self.draw_screen()
+                self.request_redraw()
             return
         
-        if self.button_pressed(KEY3_PIN, 0.2):
-            if term.command_input.strip():
+        if self.button_pressed(KEY3_PIN):
+            if term.command_running:
+                # Answer the program's prompt with the typed line
+                self.send_input_line(term, "\n")
+            elif term.command_input.strip():
                 self.execute_command(term)
-                self.draw_screen()
+                self.request_redraw()
             return
         
-        if self.button_pressed(KEY_PRESS_PIN, 0.15):
+        if self.button_pressed(KEY_PRESS_PIN):
             term.keyboard_visible = True
             term.kb_row = 0
             term.kb_col = 0
             term.scroll_offset = 0
-            self.draw_screen()
-        
-        elif self.button_pressed(KEY_UP_PIN, 0.15):
-            max_scroll = max(0, len(term.output_lines) - 6)
-            term.scroll_offset = min(term.scroll_offset + 1, max_scroll)
-            self.draw_screen()
-        
-        elif self.button_pressed(KEY_DOWN_PIN, 0.15):
-            term.scroll_offset = max(0, term.scroll_offset - 1)
-            self.draw_screen()
-        
-        elif self.button_pressed(KEY_LEFT_PIN, 0.15):
-            if term.command_history:
-                if term.history_index < len(term.command_history) - 1:
-                    term.history_index += 1
-                elif term.history_index == -1:
-                    term.history_index = 0
-                
-                if term.history_index >= 0:
-                    term.command_input = term.command_history[-(term.history_index+1)]
-                    term.cursor_pos = len(term.command_input)
-                self.draw_screen()
+            term.history_index = -1  # edited text starts a new history search
+            self.completer.prefetch(term.working_dir)
+            self.completer.refresh_commands()
+            self.request_redraw()
+        
+        elif self.button_pressed(KEY_UP_PIN):
+            max_scroll = max(0, term.screen.total_rows() - 6)
+            term.scroll_offset = min(term.scroll_offset + self.held_step(), max_scroll)
+            self.request_redraw()
+        
+        elif self.button_pressed(KEY_DOWN_PIN):
+            term.scroll_offset = max(0, term.scroll_offset - self.held_step())
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_RIGHT_PIN, 0.15):
+        elif self.button_pressed(KEY_LEFT_PIN):
+            # Older entry; typed text limits the walk to commands starting with it
+            if term.history_index == -1:
+                term.history_prefix = term.command_input
+                term.history_matches = self.history.matches(term.command_input)
+            if term.history_index < len(term.history_matches) - 1:
+                term.history_index += 1
+                term.command_input = term.history_matches[term.history_index]
+                term.cursor_pos = len(term.command_input)
+                self.request_redraw()
+        
+        elif self.button_pressed(KEY_RIGHT_PIN):
             if term.history_index > 0:
                 term.history_index -= 1
-                term.command_input = term.command_history[-(term.history_index+1)]
+                term.command_input = term.history_matches[term.history_index]
                 term.cursor_pos = len(term.command_input)
             elif term.history_index == 0:
                 term.history_index = -1
-                term.command_input = ""
-                term.cursor_pos = 0
-            self.draw_screen()
+                term.command_input = term.history_prefix
+                term.cursor_pos = len(term.command_input)
+            self.request_redraw()
     
     def handle_wifi_input(self):
         if self.entering_wifi_password:
@@ -1251,18 +3963,18 @@ class PocketTerminal:
         else:
             current_wlan = self.get_current_wlan()
             
-            if self.button_pressed(KEY_UP_PIN, 0.15):
+            if self.button_pressed(KEY_UP_PIN):
                 self.wifi_menu_section = max(0, self.wifi_menu_section - 1)
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY_DOWN_PIN, 0.15):
+            elif self.button_pressed(KEY_DOWN_PIN):
                 max_section = 2
                 if self.wlan_enabled[current_wlan]:
                     max_section = 2 + len(self.wifi_networks[current_wlan])
                 self.wifi_menu_section = min(max_section, self.wifi_menu_section + 1)
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY3_PIN, 0.15):
+            elif self.button_pressed(KEY3_PIN):
                 if self.wifi_menu_section == 0:
                     self.current_wlan_idx = (self.current_wlan_idx + 1) % len(self.available_wlans)
                     new_wlan = self.get_current_wlan()
@@ -1272,20 +3984,16 @@ class PocketTerminal:
                 
                 elif self.wifi_menu_section == 1:
                     self.toggle_wlan(current_wlan)
-                    time.sleep(0.5)
-                    self.check_all_wlan_status()
-                    if self.wlan_enabled[current_wlan]:
-                        self.scan_wifi(current_wlan)
                 
                 elif self.wifi_menu_section == 2:
                     if self.wifi_connected[current_wlan]:
                         self.disconnect_wifi(current_wlan)
-                        time.sleep(0.5)
-                        self.check_all_wlan_status()
                 
                 else:
                     net_idx = self.wifi_menu_section - 3
                     if 0 <= net_idx < len(self.wifi_networks[current_wlan]):
+                        # Keep the SSID: a background scan may reorder the list
+                        self.wifi_join_ssid = self.wifi_networks[current_wlan][net_idx]['ssid']
                         self.entering_wifi_password = True
                         self.wifi_password_input = ""
                         self.terminal.kb_row = 0
@@ -1293,16 +4001,16 @@ class PocketTerminal:
                         self.terminal.kb_page = 0
                         self.terminal.caps_lock = False
                 
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY2_PIN, 0.15):
+            elif self.button_pressed(KEY2_PIN):
                 self.current_screen = "menu"
-                self.draw_screen()
+                self.request_redraw()
     
     def handle_wifi_password_input(self):
         term = self.terminal
         
-        if self.button_pressed(KEY3_PIN, 0.18):
+        if self.button_pressed(KEY3_PIN):
             if term.kb_row == 4:
                 key = self.keyboard_bottom_row[term.kb_col]
             else:
@@ -1321,115 +4029,115 @@ class PocketTerminal:
                 term.kb_page = 1 - term.kb_page
                 term.kb_row = 0
                 term.kb_col = 0
-            elif key not in ['<-', '->']:
+            elif key not in ['<-', '->', 'TAB']:
                 if term.caps_lock and key.isalpha():
                     key = key.upper()
                 self.wifi_password_input += key
             
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_PRESS_PIN, 0.15):
+        elif self.button_pressed(KEY_PRESS_PIN):
             current_wlan = self.get_current_wlan()
-            net_idx = self.wifi_menu_section - 3
-            if 0 <= net_idx < len(self.wifi_networks[current_wlan]) and self.wifi_password_input:
-                selected_net = self.wifi_networks[current_wlan][net_idx]
-                self.connect_wifi(current_wlan, selected_net['ssid'], self.wifi_password_input)
-                time.sleep(2)
-                self.check_all_wlan_status()
+            if self.wifi_join_ssid and self.wifi_password_input:
+                self.connect_wifi(current_wlan, self.wifi_join_ssid, self.wifi_password_input)
                 self.wifi_menu_section = 2
             
             self.entering_wifi_password = False
             self.wifi_password_input = ""
             term.caps_lock = False
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_UP_PIN, 0.12):
+        elif self.button_pressed(KEY_UP_PIN):
             term.kb_row = max(0, term.kb_row - 1)
             if term.kb_row < 4:
                 term.kb_col = min(term.kb_col, len(self.keyboard_layouts[term.kb_page][term.kb_row]) - 1)
             else:
                 term.kb_col = min(term.kb_col, len(self.keyboard_bottom_row) - 1)
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_DOWN_PIN, 0.12):
+        elif self.button_pressed(KEY_DOWN_PIN):
             term.kb_row = min(4, term.kb_row + 1)
             if term.kb_row < 4:
                 term.kb_col = min(term.kb_col, len(self.keyboard_layouts[term.kb_page][term.kb_row]) - 1)
             else:
                 term.kb_col = min(term.kb_col, len(self.keyboard_bottom_row) - 1)
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_LEFT_PIN, 0.12):
+        elif self.button_pressed(KEY_LEFT_PIN):
             term.kb_col = max(0, term.kb_col - 1)
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY_RIGHT_PIN, 0.12):
+        elif self.button_pressed(KEY_RIGHT_PIN):
             if term.kb_row < 4:
                 term.kb_col = min(len(self.keyboard_layouts[term.kb_page][term.kb_row]) - 1, term.kb_col + 1)
             else:
                 term.kb_col = min(len(self.keyboard_bottom_row) - 1, term.kb_col + 1)
-            self.draw_screen()
+            self.request_redraw()
         
-        elif self.button_pressed(KEY2_PIN, 0.15):
+        elif self.button_pressed(KEY2_PIN):
             self.entering_wifi_password = False
             self.wifi_password_input = ""
             term.caps_lock = False
-            self.draw_screen()
+            self.request_redraw()
     
     def handle_settings_input(self):
         if self.in_theme_select:
-            if self.button_pressed(KEY_UP_PIN, 0.15):
+            if self.button_pressed(KEY_UP_PIN):
                 self.theme_select_index = max(0, self.theme_select_index - 1)
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY_DOWN_PIN, 0.15):
+            elif self.button_pressed(KEY_DOWN_PIN):
                 self.theme_select_index = min(len(self.theme_options) - 1, self.theme_select_index + 1)
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY3_PIN, 0.15):
+            elif self.button_pressed(KEY3_PIN):
                 self.theme = self.theme_options[self.theme_select_index]
+                self.keyboard_layers.clear()
                 self.in_theme_select = False
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY2_PIN, 0.15):
+            elif self.button_pressed(KEY2_PIN):
                 self.in_theme_select = False
-                self.draw_screen()
+                self.request_redraw()
         
         elif self.in_brightness_adjust:
-            if self.button_pressed(KEY_LEFT_PIN, 0.1):
+            if self.button_pressed(KEY_LEFT_PIN):
                 self.brightness = max(10, self.brightness - 5)
                 self.pwm.ChangeDutyCycle(self.brightness)
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY_RIGHT_PIN, 0.1):
+            elif self.button_pressed(KEY_RIGHT_PIN):
                 self.brightness = min(100, self.brightness + 5)
                 self.pwm.ChangeDutyCycle(self.brightness)
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY2_PIN, 0.15):
+            elif self.button_pressed(KEY2_PIN):
                 self.in_brightness_adjust = False
-                self.draw_screen()
+                self.request_redraw()
         
         else:
-            if self.button_pressed(KEY_UP_PIN, 0.15):
+            if self.button_pressed(KEY_UP_PIN):
                 self.settings_menu_index = max(0, self.settings_menu_index - 1)
-                self.draw_screen()
+                self.request_redraw()
             
-            elif self.button_pressed(KEY_DOWN_PIN, 0.15):
-                self.settings_menu_index = min(1, self.settings_menu_index + 1)
-                self.draw_screen()
+            elif self.button_pressed(KEY_DOWN_PIN):
+                self.settings_menu_index = min(2, self.settings_menu_index + 1)
+                self.request_redraw()
             
-            elif self.button_pressed(KEY3_PIN, 0.15):
+            elif self.button_pressed(KEY3_PIN):
                 if self.settings_menu_index == 0:
                     self.in_theme_select = True
                     self.theme_select_index = self.theme_options.index(self.theme)
                 elif self.settings_menu_index == 1:
                     self.in_brightness_adjust = True
-                self.draw_screen()
+                elif self.settings_menu_index == 2:
+                    # Takes effect at each tab's next command
+                    self.persistent_shell = not self.persistent_shell
+                self.request_redraw()
             
-            elif self.button_pressed(KEY2_PIN, 0.15):
+            elif self.button_pressed(KEY2_PIN):
                 self.current_screen = "menu"
-                self.draw_screen()
+                self.request_redraw()
     
     # ==================== TERMINAL EXECUTION ====================
     
@@ -1453,9 +4161,15 @@ class PocketTerminal:
         else:
             path_display = cwd
         
-        term.output_lines.append(f"{self.username}@pi:{path_display}"[:21])
-        term.output_lines.append(f"$ {cmd}"[:21])
-        term.command_history.append(cmd)
+        # In persistent mode only the UI builtins stay in Python
+        shell_command = self.persistent_shell and cmd.split()[0] not in ('nano', 'less', 'clear', 'exit')
+        
+        term.screen.write_line(f"{self.username}@pi:{path_display}"[:21])
+        if not shell_command:
+            term.screen.write_line(f"$ {cmd}"[:21])
+        self.history.add(cmd)
+        if self.predictor is not None:
+            self.predictor.observe(cmd)
         term.history_index = -1
         term.scroll_offset = 0
         
@@ -1464,10 +4178,13 @@ class PocketTerminal:
             if not parts:
                 return
             
+            if shell_command:
+                self.run_in_shell(term, cmd)
+            
             # Built-in: nano
-            if parts[0] == 'nano':
+            elif parts[0] == 'nano':
                 if len(parts) < 2:
-                    term.output_lines.append("Usage: nano <file>")
+                    term.screen.write_line("Usage: nano <file>")
                 else:
                     filename = parts[1]
                     # Get full path
@@ -1477,26 +4194,37 @@ class PocketTerminal:
                         filepath = os.path.join(term.working_dir, filename)
                     
                     term.nano_filename = filename
-                    term.nano_current_line = 0
-                    term.nano_cursor = 0
                     term.nano_modified = False
                     term.nano_asking_exit = False
                     
-                    # Load file if exists
+                    # Load file if exists; big ones are mapped and indexed in the background
+                    lines = None
                     if os.path.exists(filepath):
                         try:
-                            with open(filepath, 'r') as f:
-                                term.nano_lines = f.read().splitlines()
-                            if not term.nano_lines:
-                                term.nano_lines = [""]
+                            if os.path.getsize(filepath) >= NANO_MAP_BYTES:
+                                lines = LineOverlay(self.open_mapped(filepath))
+                            else:
+                                with open(filepath, 'r') as f:
+                                    lines = f.read().splitlines() or None
                         except:
-                            term.nano_lines = [""]
-                    else:
-                        term.nano_lines = [""]
+                            pass
+                    term.nano_buffer = TextBuffer(lines)
                     
                     term.in_nano = True
                     term.keyboard_visible = False
             
+            # Built-in: less
+            elif parts[0] == 'less':
+                if len(parts) < 2:
+                    term.screen.write_line("Usage: less <file>")
+                else:
+                    filename = parts[1]
+                    if filename.startswith('/'):
+                        filepath = filename
+                    else:
+                        filepath = os.path.join(term.working_dir, filename)
+                    self.open_pager(term, filename, filepath)
+            
             # Built-in: cd
             elif parts[0] == 'cd':
                 try:
@@ -1517,18 +4245,18 @@ class PocketTerminal:
                         os.chdir(pi_home)
                         term.working_dir = os.getcwd()
                 except FileNotFoundError:
-                    term.output_lines.append(f"cd: {parts[1]}: No such")
-                    term.output_lines.append("file or directory")
+                    term.screen.write_line(f"cd: {parts[1]}: No such")
+                    term.screen.write_line("file or directory")
                 except Exception as e:
-                    term.output_lines.append(f"cd: {str(e)[:15]}")
+                    term.screen.write_line(f"cd: {str(e)[:15]}")
             
             # Built-in: clear
             elif cmd == 'clear':
-                term.output_lines = []
+                term.screen.reset()
             
             # Built-in: pwd
             elif cmd == 'pwd':
-                term.output_lines.append(term.working_dir[:21])
+                term.screen.write_line(term.working_dir[:21])
             
             # Built-in: exit
             elif cmd == 'exit':
@@ -1536,106 +4264,237 @@ class PocketTerminal:
             
             # Execute other commands
             else:
-                master, slave = pty.openpty()
-                term.pty_master = master
-                term.pty_slave = slave
-                
-                term.process = subprocess.Popen(
-                    cmd,
-                    shell=True,
-                    stdin=slave,
-                    stdout=slave,
-                    stderr=slave,
-                    cwd=term.working_dir,
-                    preexec_fn=os.setsid,
-                    close_fds=True
-                )
-                
-                os.close(slave)
-                
-                flags = fcntl.fcntl(master, fcntl.F_GETFL)
-                fcntl.fcntl(master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-                
-                term.read_thread = threading.Thread(target=self.read_pty_output, args=(term,), daemon=True)
-                term.read_thread.start()
+                if term.process is not None:
+                    # Idle persistent shell left over from the other mode
+                    self.kill_process(term)
+                    self.finish_process(term)
+                self.start_pty_process(term, cmd, shell=True)
+                term.command_running = True
                     
         except Exception as e:
-            term.output_lines.append(f"Err:{str(e)[:17]}")
+            term.screen.write_line(f"Err:{str(e)[:17]}")
         
         term.command_input = ""
         term.cursor_pos = 0
         term.keyboard_visible = False
     
-    def read_pty_output(self, term):
-        """Read PTY output and display it in real-time"""
+    def start_pty_process(self, term, args, **popen_args):
+        """Run args on a fresh PTY sized to the screen, serviced by the loop"""
+        master, slave = pty.openpty()
+        term.pty_master = master
+        term.pty_slave = slave
+        term.pty_file = io.FileIO(master, 'rb', closefd=False)
+        # Keeps multi-byte characters split across reads intact
+        term.decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        
+        # Tell programs how big the screen really is
+        fcntl.ioctl(slave, termios.TIOCSWINSZ,
+                   struct.pack('HHHH', TERM_ROWS, TERM_COLS, 0, 0))
+        env = dict(os.environ, TERM='vt100',
+                  COLUMNS=str(TERM_COLS), LINES=str(TERM_ROWS))
+        
         try:
-            while term.process and term.process.poll() is None:
-                try:
-                    # Use select to check if data is available
-                    ready, _, _ = select.select([term.pty_master], [], [], 0.1)
-                    
-                    if ready:
-                        data = os.read(term.pty_master, 4096).decode('utf-8', errors='ignore')
-                        
-                        if data:
-                            # Process each line
-                            lines = data.replace('\r\n', '\n').replace('\r', '\n').split('\n')
-                            
-                            for line in lines:
-                                if line:  # Only add non-empty lines
-                                    # Split long lines into chunks of 21 chars
-                                    while len(line) > 21:
-                                        term.output_lines.append(line[:21])
-                                        line = line[21:]
-                                    if line:
-                                        term.output_lines.append(line)
-                            
-                            self.needs_redraw = True
-                    else:
-                        time.sleep(0.05)
-                        
-                except OSError as e:
-                    if e.errno == 5:  # Input/output error - process ended
-                        break
-                    time.sleep(0.05)
-                except Exception:
-                    time.sleep(0.05)
-            
-            # After process ends, try to read any remaining output
-            time.sleep(0.1)
+            term.process = subprocess.Popen(
+                args,
+                stdin=slave,
+                stdout=slave,
+                stderr=slave,
+                cwd=term.working_dir,
+                env=env,
+                preexec_fn=claim_terminal,
+                close_fds=True,
+                **popen_args
+            )
+        except:
+            os.close(master)
+            term.pty_master = None
+            term.pty_file = None
+            raise
+        finally:
+            os.close(slave)
+        
+        term.is_shell = False
+        flags = fcntl.fcntl(master, fcntl.F_GETFL)
+        fcntl.fcntl(master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        
+        self.loop.add_reader(master, lambda: self.on_pty_readable(term))
+        self.watch_process(term)
+    
+    def start_shell(self, term):
+        """Start the tab's long-lived bash, reading SHELL_RC through a pipe"""
+        rc_read, rc_write = os.pipe()
+        os.write(rc_write, SHELL_RC.encode())
+        os.close(rc_write)
+        try:
+            self.start_pty_process(term, ['bash', '--noediting', '--rcfile', f'/dev/fd/{rc_read}', '-i'],
+                                   pass_fds=(rc_read,))
+        finally:
+            os.close(rc_read)
+        term.is_shell = True
+        term.shell_ready = False
+        term.screen.osc_handler = lambda code, value: self.on_shell_marker(term, code, value)
+    
+    def run_in_shell(self, term, cmd):
+        if term.process is None:
+            self.start_shell(term)
+        term.command_running = True
+        # The tty echoes the command after the prompt, as in a real terminal
+        term.screen.feed("$ ")
+        os.write(term.pty_master, (cmd + "\n").encode())
+    
+    def on_shell_marker(self, term, code, value):
+        """PROMPT_COMMAND marker: the shell is back at its prompt"""
+        tag, _, rest = value.partition(';')
+        if code != '777' or tag != 'pocket':
+            return
+        status, _, cwd = rest.partition(';')
+        if cwd:
+            term.working_dir = cwd
+        if not term.shell_ready:
+            # First prompt after startup, not the end of a command
+            term.shell_ready = True
+            return
+        if term.command_running:
+            term.command_running = False
+            term.interrupt_time = 0
+            if status != '0':
+                term.screen.write_line(f"[exit {status}]")
+            self.request_redraw()
+    
+    def password_prompt(self, term):
+        """True while the program reads a line with echo off (sudo, ssh, passwd)"""
+        if not term.command_running or term.pty_master is None:
+            return False
+        try:
+            lflag = termios.tcgetattr(term.pty_master)[3]
+        except termios.error:
+            return False
+        return not lflag & termios.ECHO and bool(lflag & termios.ICANON)
+    
+    def send_to_process(self, term, data):
+        """Forward input to the running program in a single write"""
+        term.write_to_pty(data)
+        self.request_redraw()
+    
+    def send_input_line(self, term, terminator):
+        text = term.command_input
+        if self.password_prompt(term):
+            # Nothing echoes a password: show its length where it was typed
+            term.screen.feed("*" * len(text))
+        # With echo on the tty echoes during the write itself, so the text
+        # is on screen by the next loop pass without a local copy
+        self.send_to_process(term, (text + terminator).encode())
+        term.command_input = ""
+        term.cursor_pos = 0
+    
+    def stop_command(self, term):
+        """Kill the running command; a persistent shell itself survives"""
+        if not term.is_shell:
+            os.killpg(os.getpgid(term.process.pid), 9)
+            return
+        pgrp = os.tcgetpgrp(term.pty_master)
+        if pgrp == term.process.pid:
+            # Builtins and loops run in the shell itself: interrupt them
+            os.killpg(pgrp, signal.SIGINT)
+        else:
+            os.killpg(pgrp, signal.SIGKILL)
+    
+    def kill_process(self, term):
+        """End the tab's process for good, shell and jobs included"""
+        if term.process is None:
+            return
+        try:
+            if term.is_shell:
+                # bash passes SIGHUP on to its jobs before exiting
+                term.process.send_signal(signal.SIGHUP)
+                term.process.wait(1)
+            else:
+                os.killpg(os.getpgid(term.process.pid), 9)
+                term.process.wait()
+        except:
             try:
-                while True:
-                    ready, _, _ = select.select([term.pty_master], [], [], 0.1)
-                    if ready:
-                        data = os.read(term.pty_master, 4096).decode('utf-8', errors='ignore')
-                        if not data:
-                            break
-                        
-                        lines = data.replace('\r\n', '\n').replace('\r', '\n').split('\n')
-                        for line in lines:
-                            if line:
-                                while len(line) > 21:
-                                    term.output_lines.append(line[:21])
-                                    line = line[21:]
-                                if line:
-                                    term.output_lines.append(line)
-                    else:
-                        break
+                os.killpg(term.process.pid, 9)
             except:
                 pass
-            
+    
+    def append_output(self, term, data):
+        term.screen.feed(data)
+    
+    def read_pty(self, term):
+        """Read one chunk from the PTY
+        
+        Returns the number of bytes read (0 if nothing is waiting), or None
+        once the slave side has been closed.
+        """
+        try:
+            count = term.pty_file.readinto(self.pty_buffer)
+        except OSError:
+            # EIO: every process holding the slave has exited
+            return None
+        
+        if count is None:
+            return 0
+        if not count:
+            return None
+        self.append_output(term, term.decoder.decode(self.pty_view[:count]))
+        if term is self.terminal:
+            self.request_redraw()
+        elif not term.unseen_output:
+            term.unseen_output = True
+            self.request_redraw()
+        return count
+    
+    def on_pty_readable(self, term):
+        """Display PTY output in real-time as the loop reports it"""
+        if term.pty_master is None:
+            return
+        if self.read_pty(term) is None:
+            self.finish_process(term)
+    
+    def watch_process(self, term):
+        """Get a loop callback when the command exits"""
+        try:
+            term.pidfd = os.pidfd_open(term.process.pid)
+            self.loop.add_reader(term.pidfd, lambda: self.finish_process(term))
+        except (AttributeError, OSError):
+            # No pidfd support: fall back to checking every 200 ms
+            def poll_exit():
+                if term.process is None:
+                    return
+                if term.process.poll() is None:
+                    self.loop.call_later(0.2, poll_exit)
+                else:
+                    self.finish_process(term)
+            self.loop.call_later(0.2, poll_exit)
+    
+    def finish_process(self, term):
+        if term.pty_master is not None:
+            # After process ends, read any remaining output
+            while self.read_pty(term):
+                pass
+            self.loop.remove_reader(term.pty_master)
+            self.append_output(term, term.decoder.decode(b'', final=True))
             try:
                 os.close(term.pty_master)
             except:
                 pass
-            
-            term.process = None
             term.pty_master = None
-            self.needs_redraw = True
-            
-        except Exception as e:
-            print(f"PTY read error: {e}")
+            term.pty_file = None
+        
+        if term.pidfd is not None:
+            self.loop.remove_reader(term.pidfd)
+            os.close(term.pidfd)
+            term.pidfd = None
+        
+        if term.process is not None:
+            term.process.poll()
             term.process = None
+        term.command_running = False
+        term.interrupt_time = 0
+        term.is_shell = False
+        term.screen.osc_handler = None
+        term.screen.soft_reset()
+        self.request_redraw()
     
     def shutdown_pi(self):
         print("\n!!! SHUTDOWN !!!")
@@ -1669,22 +4528,18 @@ class PocketTerminal:
         
         try:
             while self.running:
-                self.handle_input()
-                
-                if self.needs_redraw:
-                    self.draw_screen()
-                
-                time.sleep(0.02)
+                self.loop.run_once()
         
         except KeyboardInterrupt:
             print("\nExiting...")
         
         finally:
-            if self.terminal.process:
-                try:
-                    os.killpg(os.getpgid(self.terminal.process.pid), 9)
-                except:
-                    pass
+            for term in self.sessions:
+                self.kill_process(term)
+                self.close_pager(term)
+                self.close_nano(term)
+            self.worker.shutdown()
+            self.metrics.stop()
             
             self.pwm.stop()
             GPIO.cleanup()
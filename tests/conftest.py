@@ -0,0 +1,27 @@
+"""Make terminal.py importable off the Pi
+
+The LCD driver lives next to the installed copy, not in the clone, and
+RPi.GPIO refuses to load anywhere but a Pi. Nothing touches either at
+import time, so empty stand-ins are enough for the backend tests.
+"""
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def stub(name):
+    try:
+        __import__(name)
+    except Exception:
+        module = types.ModuleType(name)
+        sys.modules[name] = module
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, module)
+
+
+stub('LCD_1in44')
+stub('RPi')
+stub('RPi.GPIO')
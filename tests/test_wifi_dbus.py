@@ -0,0 +1,176 @@
+"""NetworkManagerWifi against a fake bus connection
+
+Replies and signals are serialised and parsed back with jeepney, so the
+backend sees exactly what it would read off a real socket.
+"""
+import itertools
+import queue
+
+import pytest
+
+jeepney = pytest.importorskip("jeepney")
+terminal = pytest.importorskip("terminal")  # conftest.py stands in for the LCD and GPIO modules
+
+from jeepney import DBusAddress, HeaderFields, new_error, new_method_return, new_signal
+from jeepney.low_level import Parser
+
+NM = terminal.NetworkManagerWifi
+DEVICE_PATH = NM.ROOT + '/Devices/3'
+AP_HOME = NM.ROOT + '/AccessPoint/1'
+AP_CAFE = NM.ROOT + '/AccessPoint/2'
+AP_CAFE_FAR = NM.ROOT + '/AccessPoint/3'
+
+
+serials = itertools.count(1)
+
+
+def over_the_wire(message):
+    parser = Parser()
+    parser.add_data(message.serialise(serial=next(serials)))
+    return parser.get_next_message()
+
+
+class FakeNetworkManager:
+    """Answers method calls from a property table, like NetworkManager would"""
+
+    def __init__(self):
+        self.properties = {
+            (NM.ROOT, NM.SERVICE): {'WirelessEnabled': ('b', True)},
+            (DEVICE_PATH, NM.DEVICE): {'State': ('u', NM.STATE_ACTIVATED)},
+            (DEVICE_PATH, NM.WIRELESS): {'ActiveAccessPoint': ('o', AP_HOME)},
+            (AP_HOME, NM.ACCESS_POINT): {'Ssid': ('ay', b'HomeNet'), 'Strength': ('y', 80)},
+            (AP_CAFE, NM.ACCESS_POINT): {'Ssid': ('ay', b'Cafe'), 'Strength': ('y', 60)},
+            (AP_CAFE_FAR, NM.ACCESS_POINT): {'Ssid': ('ay', b'Cafe'), 'Strength': ('y', 70)},
+        }
+        self.denied = set()     # methods that fail as polkit would refuse them
+        self.activation = []    # states the next active connection reports, in order
+        self.calls = []
+        self.signals = queue.Queue()
+
+    def reply(self, message):
+        fields = message.header.fields
+        path, member = fields[HeaderFields.path], fields[HeaderFields.member]
+        self.calls.append((path, member))
+        if member in self.denied:
+            return new_error(message, 'org.freedesktop.NetworkManager.PermissionDenied', 's', ('Not authorized',))
+        if member == 'GetDevices':
+            return new_method_return(message, 'ao', ([DEVICE_PATH],))
+        if member == 'GetDeviceByIpIface':
+            return new_method_return(message, 'o', (DEVICE_PATH,))
+        if member == 'GetAllAccessPoints':
+            return new_method_return(message, 'ao', ([AP_HOME, AP_CAFE, AP_CAFE_FAR],))
+        if member == 'AddAndActivateConnection':
+            self.properties[('/active/1', NM.ACTIVE_CONNECTION)] = {'State': ('u', 1)}
+            return new_method_return(message, 'oo', ('/profile/1', '/active/1'))
+        if member == 'Get':
+            interface, name = message.body
+            if path == '/active/1' and self.activation:
+                self.properties[(path, interface)]['State'] = ('u', self.activation.pop(0))
+            return new_method_return(message, 'v', (self.properties[(path, interface)][name],))
+        if member == 'GetAll':
+            return new_method_return(message, 'a{sv}', (self.properties[(path, message.body[0])],))
+        return new_method_return(message)
+
+    def emit(self, path, interface, member, signature, body):
+        self.signals.put(new_signal(DBusAddress(path, interface=interface), member, signature, body))
+
+    def open_connection(self, bus='SYSTEM'):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, nm):
+        self.nm = nm
+
+    def send_and_get_reply(self, message, timeout=None):
+        return over_the_wire(self.nm.reply(over_the_wire(message)))
+
+    def receive(self):
+        return over_the_wire(self.nm.signals.get(timeout=5))
+
+
+class FakeNmcli:
+    def __init__(self):
+        self.calls = []
+
+    def set_radio(self, on):
+        self.calls.append(('set_radio', on))
+        return True
+
+    def connect(self, wlan, ssid, password):
+        self.calls.append(('connect', wlan, ssid))
+        return False
+
+    def disconnect(self, wlan):
+        self.calls.append(('disconnect', wlan))
+        return True
+
+
+@pytest.fixture
+def nm(monkeypatch):
+    fake = FakeNetworkManager()
+    monkeypatch.setattr(terminal, 'open_dbus_connection', fake.open_connection)
+    return fake
+
+
+def make_backend(nm):
+    events = queue.Queue()
+    backend = NM(lambda kind, wlan: events.put((kind, wlan)))
+    backend.fallback = FakeNmcli()
+    return backend, events
+
+
+def test_status_decodes_state_and_ssid(nm):
+    backend, _ = make_backend(nm)
+    assert backend.status('wlan0') == (True, 'HomeNet')
+
+    nm.properties[(DEVICE_PATH, NM.DEVICE)]['State'] = ('u', NM.STATE_UNAVAILABLE)
+    assert backend.status('wlan0') == (False, None)
+
+
+def test_access_points_keep_the_strongest_per_ssid(nm):
+    backend, _ = make_backend(nm)
+    assert backend.access_points('wlan0') == [{'ssid': 'HomeNet', 'signal': '80'},
+                                              {'ssid': 'Cafe', 'signal': '70'}]
+
+
+def test_signals_become_notifications(nm):
+    backend, events = make_backend(nm)
+    backend.status('wlan0')     # learns the device path for wlan0
+
+    nm.emit(DEVICE_PATH, NM.WIRELESS, 'AccessPointAdded', 'o', (AP_CAFE,))
+    assert events.get(timeout=5) == ('networks', 'wlan0')
+
+    nm.emit(DEVICE_PATH, NM.DEVICE, 'StateChanged', 'uuu', (NM.STATE_ACTIVATED, 30, 0))
+    assert events.get(timeout=5) == ('status', 'wlan0')
+
+    nm.emit(DEVICE_PATH, 'org.freedesktop.DBus.Properties', 'PropertiesChanged', 'sa{sv}as',
+            (NM.WIRELESS, {'ActiveAccessPoint': ('o', AP_CAFE)}, []))
+    assert events.get(timeout=5) == ('status', 'wlan0')
+
+    nm.emit(NM.ROOT, 'org.freedesktop.DBus.Properties', 'PropertiesChanged', 'sa{sv}as',
+            (NM.SERVICE, {'WirelessEnabled': ('b', False)}, []))
+    assert events.get(timeout=5) == ('status', None)
+    assert backend.pushes_updates
+
+
+def test_connect_follows_the_active_connection(nm):
+    backend, _ = make_backend(nm)
+    # The device is already up on HomeNet; only the new activation counts
+    nm.activation = [1, 1, NM.ACTIVE_ACTIVATED]
+    assert backend.connect('wlan0', 'Cafe', 'secret')
+
+    nm.activation = [1, NM.ACTIVE_DEACTIVATED]
+    assert not backend.connect('wlan0', 'Cafe', 'wrong')
+    assert ('/profile/1', 'Delete') in nm.calls
+
+
+def test_refused_changes_go_to_nmcli(nm):
+    backend, _ = make_backend(nm)
+    nm.denied = {'Set', 'Disconnect', 'AddAndActivateConnection'}
+
+    assert backend.set_radio(False)
+    assert backend.disconnect('wlan0')
+    assert not backend.connect('wlan0', 'Cafe', 'secret')
+    assert backend.fallback.calls == [('set_radio', False), ('disconnect', 'wlan0'),
+                                      ('connect', 'wlan0', 'Cafe')]